@@ -1,14 +1,25 @@
 
 
+from typing import Optional
+
+
 class PMLBaseException(Exception):
     """Base class for all PML exceptions."""
     def __init__(self, line_number:int):
         self.line_number = line_number
         self._message:str = ""
+        # Set when the error happens inside an included fragment, line_number is then counted in this file
+        self.file_path:Optional[str] = None
+    
+    @property
+    def Position(self):
+        if self.file_path is not None:
+            return f'Line {self.line_number} of "{self.file_path}"'
+        return f"Line {self.line_number}"
     
     @property
     def Message(self):
-        return f"{self.__class__.__name__} at Line {self.line_number}: {self._message}"
+        return f"{self.__class__.__name__} at {self.Position}: {self._message}"
     
     def __repr__(self) -> str:
         return self.Message
@@ -24,7 +35,7 @@ class UnknownError(PMLBaseException):
         
     @property
     def Message(self):
-        return f"{self.__class__.__name__} at Line {self.line_number}: {self.original_exception}"
+        return f"{self.__class__.__name__} at {self.Position}: {self.original_exception}"
 
 class SyntaxError(PMLBaseException):
     """Syntax error in PML file."""
@@ -41,6 +52,29 @@ class LoopKeywordUnpairedError(SyntaxError):
         super().__init__(line_number)
         self._message = unpaired_loop
         
+class IfKeywordUnpairedError(SyntaxError):
+    def __init__(self, line_number:int, unpaired_keyword:str):
+        super().__init__(line_number)
+        self._message = unpaired_keyword
+        
+class IncludeCycleError(SyntaxError):
+    def __init__(self, line_number:int, include_chain:list[str]):
+        super().__init__(line_number)
+        self._include_chain = include_chain
+        
+    @property
+    def Message(self):
+        return f'{self.__class__.__name__} at {self.Position}: Circular include "{" -> ".join(self._include_chain)}"'
+        
+class IncludeFileNotFoundError(SyntaxError):
+    def __init__(self, line_number:int, include_path:str):
+        super().__init__(line_number)
+        self._include_path = include_path
+        
+    @property
+    def Message(self):
+        return f'{self.__class__.__name__} at {self.Position}: Included file "{self._include_path}" not found'
+        
 class AssignReadOnlyError(SyntaxError):
     def __init__(self, line_number:int, variable_name:str):
         super().__init__(line_number)
@@ -48,7 +82,7 @@ class AssignReadOnlyError(SyntaxError):
         
     @property
     def Message(self):
-        return f'{self.__class__.__name__} at Line {self.line_number}: "{self._variable_name}" is read-only, cannot be assigned'
+        return f'{self.__class__.__name__} at {self.Position}: "{self._variable_name}" is read-only, cannot be assigned'
         
 class VariableReferenceError(SematicError):
     def __init__(self, line_number:int, variable_name:str, extra_info:str=""):
@@ -58,7 +92,7 @@ class VariableReferenceError(SematicError):
         
     @property
     def Message(self):
-        info = f'{self.__class__.__name__} at Line {self.line_number}: Undefined variable "{self._variable_name}"'
+        info = f'{self.__class__.__name__} at {self.Position}: Undefined variable "{self._variable_name}"'
         if self._extra_info != "":
             info += f", {self._extra_info}"
         return info
@@ -71,7 +105,7 @@ class ExpressionEvaluationUnknownExceptionError(SematicError):
         
     @property
     def Message(self):
-        return f'{self.__class__.__name__} at Line {self.line_number}: Expression "{self._expression}", {self._original_exception}'
+        return f'{self.__class__.__name__} at {self.Position}: Expression "{self._expression}", {self._original_exception}'
     
 class PathNotFoundError(SematicError):
     def __init__(self, line_number:int, total_path:str, error_path:str, already_found_path:str):
@@ -82,7 +116,7 @@ class PathNotFoundError(SematicError):
         
     @property
     def Message(self):
-        return f'{self.__class__.__name__} at Line {self.line_number}: Path "{self._total_path}" not found, error path "{self._error_path}", already found path "{self._already_found_path}"'
+        return f'{self.__class__.__name__} at {self.Position}: Path "{self._total_path}" not found, error path "{self._error_path}", already found path "{self._already_found_path}"'
     
 class LoopPathNotListError(SematicError):
     def __init__(self, line_number:int, total_path:str):
@@ -91,7 +125,7 @@ class LoopPathNotListError(SematicError):
         
     @property
     def Message(self):
-        return f'{self.__class__.__name__} at Line {self.line_number}: Using loop keyword on path "{self._total_path}", but the path is not a list'
+        return f'{self.__class__.__name__} at {self.Position}: Using loop keyword on path "{self._total_path}", but the path is not a list'
     
 class InvalidListIndexOrSlice(PathNotFoundError):
     pass
@@ -106,7 +140,7 @@ class ListOutOfIndexError(SematicError):
         
     @property
     def Message(self):
-        return f'{self.__class__.__name__} at Line {self.line_number}: Path "{self._total_path}" not found, {self._error_index} out of the index (total length {self._total_length}), already found path "{self._already_found_path}"'
+        return f'{self.__class__.__name__} at {self.Position}: Path "{self._total_path}" not found, {self._error_index} out of the index (total length {self._total_length}), already found path "{self._already_found_path}"'
     
 class TypeError(SematicError):
     def __init__(self, line_number:int, expecting_types:list[str], error_type:str):
@@ -116,7 +150,7 @@ class TypeError(SematicError):
     
     @property
     def Message(self):
-        return f'{self.__class__.__name__} at Line {self.line_number}: Expecting type "{self._expecting_types}", but got "{self._error_type}"'
+        return f'{self.__class__.__name__} at {self.Position}: Expecting type "{self._expecting_types}", but got "{self._error_type}"'
     
 class ImproperTypeDataInExpressionError(TypeError):
     def __init__(self, line_number:int, expression:str, data_path:str, error_type:str):
@@ -139,4 +173,17 @@ class ImproperTypeDataInListSliceError(TypeError):
         
     @property
     def Message(self):
-        return f'{super().Message} at Line {self.line_number}: Expression "{self._expression}" evaluated to "{self._eval_result}"(Type "{self._error_type}") cannot be used in list slice "{self._data_path}"'
\ No newline at end of file
+        return f'{super().Message} at {self.Position}: Expression "{self._expression}" evaluated to "{self._eval_result}"(Type "{self._error_type}") cannot be used in list slice "{self._data_path}"'
+class RecordNotValidatedError(SematicError):
+    """Record given to build_prompt_unchecked has not the keys of the records given to validate(), or validate() is not called."""
+    def __init__(self, record_keys:list[str], validated_keys:Optional[list[str]]):
+        # Not caused by a line of the template
+        super().__init__(0)
+        self._record_keys = record_keys
+        self._validated_keys = validated_keys
+        
+    @property
+    def Message(self):
+        if self._validated_keys is None:
+            return f'{self.__class__.__name__}: Call validate() with sample records before building prompt unchecked'
+        return f'{self.__class__.__name__}: Record keys {self._record_keys} differ from keys of validated records {self._validated_keys}'
@@ -1,5 +1,9 @@
 from .pml_parser import PmlParser as PmlParser
+from .template_registry import TemplateRegistry as TemplateRegistry
+from .metrics import METRICS as METRICS
+from .render_session import RenderSession as RenderSession
+from .template_group import TemplateGroup as TemplateGroup
 from . import Errors
 
 
-__all__=['PmlParser','Errors']
\ No newline at end of file
+__all__=['PmlParser','TemplateRegistry','RenderSession','TemplateGroup','METRICS','Errors']
\ No newline at end of file
@@ -9,6 +9,9 @@ class KeywordEnum(Enum):
     Assignment:str = "var"
     Comment:str = "#"
     Print:str = "print"
+    Include:str = "include"
+    If:str = "if"
+    Else:str = "else"
     
 class ReservedWordEnum(Enum):
     Index:str = "index"
@@ -0,0 +1,131 @@
+import bisect
+import threading
+
+
+# Upper bounds of histogram buckets, the last bucket (+Inf) is implicit
+SECONDS_BUCKETS:tuple[float, ...] = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+BYTES_BUCKETS:tuple[float, ...] = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+class Histogram():
+    def __init__(self, buckets:tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.bucket_counts:list[int] = [0] * (len(buckets) + 1)
+        self.sum:float = 0.0
+        self.count:int = 0
+
+    def observe(self, value:float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry():
+    """
+    Counters and histograms of parsing and rendering, labeled by template name.
+    Disabled by default: callers check `is_enabled` before measuring, so it costs one attribute read per parse/render.
+    """
+    def __init__(self, is_enabled:bool=False, prefix:str="promaid") -> None:
+        self.is_enabled = is_enabled
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        # name -> labels -> value
+        self._counters:dict[str, dict[tuple[tuple[str, str], ...], float]] = {}
+        self._histograms:dict[str, dict[tuple[tuple[str, str], ...], Histogram]] = {}
+        self._descriptions:dict[str, str] = {}
+
+    def enable(self):
+        self.is_enabled = True
+
+    def disable(self):
+        self.is_enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def describe(self, name:str, description:str):
+        self._descriptions[name] = description
+
+    def increase(self, name:str, value:float=1, **labels:str):
+        label_key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._counters.setdefault(name, {})
+            values[label_key] = values.get(label_key, 0) + value
+
+    def observe(self, name:str, value:float, buckets:tuple[float, ...]=SECONDS_BUCKETS, **labels:str):
+        label_key = tuple(sorted(labels.items()))
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            if label_key not in histograms:
+                histograms[label_key] = Histogram(buckets)
+            histograms[label_key].observe(value)
+
+    def as_dict(self):
+        """
+        Returns:
+            dict: {"counters": {name: [{"labels": ..., "value": ...}]}, "histograms": {name: [{"labels": ..., "buckets": {upper bound: cumulative count}, "sum": ..., "count": ...}]}}
+        """
+        with self._lock:
+            counters = {name: [{"labels": dict(label_key), "value": value} for label_key, value in values.items()]
+                        for name, values in self._counters.items()}
+            histograms = {}
+            for name, values in self._histograms.items():
+                histograms[name] = []
+                for label_key, histogram in values.items():
+                    cumulative_counts = _accumulate(histogram.bucket_counts)
+                    buckets = {str(bound): count for bound, count in zip(list(histogram.buckets) + ["+Inf"], cumulative_counts)}
+                    histograms[name].append({"labels": dict(label_key), "buckets": buckets, "sum": histogram.sum, "count": histogram.count})
+        return {"counters": counters, "histograms": histograms}
+
+    def to_prometheus(self):
+        """
+        Returns:
+            str: Metrics in Prometheus text exposition format.
+        """
+        lines:list[str] = []
+        metrics = self.as_dict()
+        for name, values in metrics["counters"].items():
+            full_name = f"{self._prefix}_{name}"
+            self._append_header(lines, name, full_name, "counter")
+            for value in values:
+                lines.append(f"{full_name}{_format_labels(value['labels'])} {value['value']}")
+        for name, values in metrics["histograms"].items():
+            full_name = f"{self._prefix}_{name}"
+            self._append_header(lines, name, full_name, "histogram")
+            for value in values:
+                for bound, count in value["buckets"].items():
+                    lines.append(f"{full_name}_bucket{_format_labels({**value['labels'], 'le': bound})} {count}")
+                lines.append(f"{full_name}_sum{_format_labels(value['labels'])} {value['sum']}")
+                lines.append(f"{full_name}_count{_format_labels(value['labels'])} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def _append_header(self, lines:list[str], name:str, full_name:str, metric_type:str):
+        if name in self._descriptions:
+            lines.append(f"# HELP {full_name} {self._descriptions[name]}")
+        lines.append(f"# TYPE {full_name} {metric_type}")
+
+def _accumulate(counts:list[int]):
+    result:list[int] = []
+    total = 0
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+def _format_labels(labels:dict[str, str]):
+    if len(labels) == 0:
+        return ""
+    escaped = [f'{key}="{_escape_label_value(str(value))}"' for key, value in labels.items()]
+    return "{" + ",".join(escaped) + "}"
+
+def _escape_label_value(value:str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+METRICS = MetricsRegistry()
+METRICS.describe("parse_seconds", "Time to parse a template, including optimization and analysis.")
+METRICS.describe("render_seconds", "Time to fill data into a template tree and build the prompt.")
+METRICS.describe("output_bytes", "UTF-8 size of built prompts.")
+METRICS.describe("loop_iterations_total", "Loop body copies filled with data.")
+METRICS.describe("expression_evaluations_total", "Expressions processed for eval, including list index and slice.")
+METRICS.describe("lookup_cache_total", "Render-scoped path and len() cache lookups, by kind and result.")
+METRICS.describe("fragment_cache_total", "Included fragment lookups, by result.")
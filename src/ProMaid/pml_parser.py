@@ -1,21 +1,40 @@
+import contextlib
 import copy
 from enum import Enum
+import hashlib
+import os
 import re
-from typing import Optional, Union
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Optional, Union
 
 from .keyword_enum import KeywordEnum, ReservedWordEnum, TagPatternsEnum, FunctionPatternsEnum
-from .prompt_tree_node import AssignmentNode, BaseNode, DataNode, EmptyNode, CalculationNode, PrintNode, LoopNode, NonTerminalNode, parse_children
-from .Errors import AssignReadOnlyError, ExpressionEvaluationUnknownExceptionError, InvalidListIndexOrSlice, ListOutOfIndexError, PathNotFoundError, UnknownError, VariableReferenceError, ImproperTypeDataInExpressionError, LoopPathNotListError, ImproperTypeDataInListSliceError
+from .prompt_tree_node import AssignmentNode, BaseNode, DataNode, EmptyNode, PlainTextNode, CalculationNode, IfNode, IncludeNode, PrintNode, LoopNode, NonTerminalNode, collect_included_files, parse_children, try_decompose_assignment
+from .metrics import BYTES_BUCKETS, METRICS
+from .source_map import SourceMap
+from .span_map import SpanMap
+from .static_analysis import IDENTIFIER_PATTERN, PURE_BUILTIN_NAMES, ConstantFolder, RootDataNameCollector, StaticAnalyzer, mark_independent_loops
+from .Errors import PMLBaseException, IncludeCycleError, IncludeFileNotFoundError, AssignReadOnlyError, ExpressionEvaluationUnknownExceptionError, InvalidListIndexOrSlice, ListOutOfIndexError, PathNotFoundError, UnknownError, VariableReferenceError, ImproperTypeDataInExpressionError, LoopPathNotListError, ImproperTypeDataInListSliceError, RecordNotValidatedError
 
 class PmlParser():
     def __init__(self, 
                  template:Optional[str]=None, 
                  template_path:Optional[str]=None, 
                  is_clean_whitespace_at_the_end_of_lines:bool=False,
-                 is_reserve_comments:bool=False
+                 is_reserve_comments:bool=False,
+                 is_optimize:bool=True,
+                 max_loop_workers:int=1,
+                 min_parallel_loop_iterations:int=64,
+                 name:Optional[str]=None
                  ) -> None:
+        parse_start_time = time.perf_counter() if METRICS.is_enabled else 0.0
+        # Label of this template in metrics
+        self.name:str = name if name is not None else (template_path if template_path is not None else "<string>")
         self._original_template:Optional[str] = template
         self._template:Optional[str] = template
+        self._template_path:Optional[str] = template_path
         if template_path is not None:
             self._template = open(template_path, 'r', encoding='utf-8').read()
             if not template_path.endswith(".pml") and not template_path.endswith(".PML"):
@@ -25,7 +44,41 @@ class PmlParser():
         self._global_variable_dict:dict[str, Union[int, float]] = {}
         self._is_clean_whitespace = is_clean_whitespace_at_the_end_of_lines
         self._is_reserve_comments = is_reserve_comments
+        self._is_optimize = is_optimize
         self.template_tree = self._parse_syntax_tree()
+        # How many nodes are evaluated at parse time / removed from the tree, see ConstantFolder
+        self.optimization_stats:dict[str, int] = {"folded": 0, "eliminated": 0}
+        if self._is_optimize:
+            folder = ConstantFolder()
+            folder.optimize(self.template_tree)
+            self.optimization_stats = {"folded": folder.folded_node_count, "eliminated": folder.eliminated_node_count}
+        mark_independent_loops(self.template_tree)
+        # Iterations of loops writing no variable are filled by at most max_loop_workers threads of the shared pool, 
+        # if the loop is long enough and the interpreter runs threads in parallel (free-threaded build), see _is_parallel_loop
+        self._max_loop_workers = max_loop_workers
+        self._min_parallel_loop_iterations = min_parallel_loop_iterations
+        self._loop_thread_state = threading.local()
+        self._static_data:dict = {}
+        # (static_prefix, prefix_hash, global variables after the prefix, where the suffix starts), computed once per static data binding,
+        # see _build_static_prefix
+        self._static_prefix_cache:Optional[tuple[str, str, dict[str, Union[int, float]], list[tuple[NonTerminalNode, int]]]] = None
+        # Render-scoped caches of resolved paths and len(), key -> (base data of the path, value), see _get_lookup_cache_key
+        self._path_cache:dict[tuple, tuple[object, object]] = {}
+        self._len_cache:dict[tuple, tuple[object, int]] = {}
+        # raw path -> variables used in its list index/slice, None if the path can't be cached
+        self._path_dependencies:dict[str, Optional[tuple[str, ...]]] = {}
+        self.lookup_cache_stats:dict[str, int] = {"path_hits": 0, "path_misses": 0, "len_hits": 0, "len_misses": 0}
+        # Caches are given by the caller and shared with other parsers rendering the same data, see _use_lookup_caches
+        self._is_lookup_cache_shared:bool = False
+        # Top level keys of the records given to validate(), unchecked render is only allowed for records with these keys
+        self._validated_keys:Optional[frozenset[str]] = None
+        # Counted in each render, reported to METRICS
+        self._render_loop_iterations:int = 0
+        self._render_expression_evaluations:int = 0
+        # Depth of nested _measuring_render, only the outermost one reports
+        self._render_depth:int = 0
+        if METRICS.is_enabled:
+            METRICS.observe("parse_seconds", time.perf_counter() - parse_start_time, template=self.name)
         
     @property
     def template(self):
@@ -61,12 +114,18 @@ class PmlParser():
                 return KeywordEnum.Assignment, path
             elif keyword == KeywordEnum.Print.value:
                 return KeywordEnum.Print, path
+            elif keyword == KeywordEnum.Include.value:
+                return KeywordEnum.Include, path
+            elif keyword == KeywordEnum.If.value:
+                return KeywordEnum.If, path
             else:
                 return KeywordEnum.PlainText, tag
         elif (match := re.match(TagPatternsEnum.TagWithoutPath.value, tag)) is not None:
             keyword = match.group(1)
             if keyword == KeywordEnum.LoopEnd.value:
                 return KeywordEnum.LoopEnd, ""
+            elif keyword == KeywordEnum.Else.value:
+                return KeywordEnum.Else, ""
             else:
                 return KeywordEnum.PlainText, tag
         else:
@@ -95,24 +154,27 @@ class PmlParser():
             processing = splits[1]
         return result
     
-    def _preprocess_invisible_keywords(self, words_list:list[dict[str, int|str]]):
+    def _preprocess_invisible_keywords(self, offsets:list[int], words:list[str]):
+        """
+        Args:
+            offsets (list[int]): Offset of each word in template, changed together with words
+            words (list[str])
+        """
         index = 0
-        while index < len(words_list):
-            pack_dict = words_list[index]
-            line_number = pack_dict['line']
-            word_type, _ = self._decompose_tag_as_keyword_and_path(pack_dict['word']) # type: ignore
-            # loop-start, TagTypeEnum.LoopEnd, assignment will not appear in the prompt, called invisible keywords
+        while index < len(words):
+            word_type, _ = self._decompose_tag_as_keyword_and_path(words[index])
+            # loop-start, TagTypeEnum.LoopEnd, assignment, include, if, else will not appear in the prompt, called invisible keywords
             # They always appear as single line, so we need to remove the \n after them
-            if word_type in [KeywordEnum.LoopStart, KeywordEnum.LoopEnd, KeywordEnum.Assignment]: 
+            if word_type in [KeywordEnum.LoopStart, KeywordEnum.LoopEnd, KeywordEnum.Assignment, KeywordEnum.Include, KeywordEnum.If, KeywordEnum.Else]: 
                 # If it is the last word, we don't need to remove the \n
-                if index == len(words_list)-1:
+                if index == len(words)-1:
                     index += 1
                     continue
                 else:
-                    if words_list[index+1]['word'][0] == '\n': # type: ignore
-                        words_list[index+1]['word'] = words_list[index+1]['word'][1:] # type: ignore
+                    if words[index+1].startswith('\n'):
+                        words[index+1] = words[index+1][1:]
             elif word_type == KeywordEnum.Comment:
-                if index == len(words_list)-1 or index == 0:
+                if index == len(words)-1 or index == 0:
                     index += 1
                     continue
                 else:
@@ -120,14 +182,14 @@ class PmlParser():
                     # create a NEW word before the comment
                     # Give the white space before the comment to this NEW word
                     # and give the \n after the comment back to this NEW word
-                    if words_list[index-1]['word'] == "" or words_list[index-1]['word'][-1] != '\n': # type: ignore
-                        new_word = {'line':line_number, 'word':""} # type: ignore
-                        words_list.insert(index, new_word)
+                    if words[index-1] == "" or words[index-1][-1] != '\n':
+                        words.insert(index, "")
+                        offsets.insert(index, offsets[index])
                         index += 1
-                        if not words_list[index]['word'].startswith(KeywordEnum.Comment.value): # type: ignore
-                            words_list[index-1]['word'] = words_list[index-1]['word'] + words_list[index]['word'].split(KeywordEnum.Comment.value)[0] # type: ignore
-                        words_list[index-1]['word'] = words_list[index-1]['word'] + '\n' # type: ignore
-                        words_list[index]['word'] = words_list[index]['word'].strip() # type: ignore
+                        if not words[index].startswith(KeywordEnum.Comment.value):
+                            words[index-1] = words[index-1] + words[index].split(KeywordEnum.Comment.value)[0]
+                        words[index-1] = words[index-1] + '\n'
+                        words[index] = words[index].strip()
             index += 1
     
     def _clean_whitespace_at_the_end_of_lines(self, template:str):
@@ -146,16 +208,112 @@ class PmlParser():
                 whitespace_cache = ''
         return result
     
-    def _clean_empty_tokens(self, word_list_with_line_number:list[dict[str, int|str]]):
-        new_list = []
-        for word_dict in word_list_with_line_number:
-            if word_dict['word'] != '':
-                new_list.append(word_dict)
-        return new_list
+    def _clean_empty_tokens(self, offsets:list[int], words:list[str]):
+        new_offsets:list[int] = []
+        new_words:list[str] = []
+        for offset, word in zip(offsets, words):
+            if word != '':
+                new_offsets.append(offset)
+                new_words.append(word)
+        return new_offsets, new_words
+    
+    def _get_path_dependencies(self, raw_path:str):
+        if raw_path not in self._path_dependencies:
+            dependencies:Optional[set[str]] = set()
+            for sub_path in raw_path.split('.'):
+                if not (sub_path.startswith('[') and sub_path.endswith(']')):
+                    continue
+                # data() and len() inside index are not tracked
+                if re.search(FunctionPatternsEnum.Data.value, sub_path) or re.search(FunctionPatternsEnum.Length.value, sub_path):
+                    dependencies = None
+                    break
+                dependencies.update(name for name in re.findall(IDENTIFIER_PATTERN, sub_path[1:-1]) 
+                                    if name not in PURE_BUILTIN_NAMES and name != ReservedWordEnum.Reverse.value)
+            self._path_dependencies[raw_path] = tuple(sorted(dependencies)) if dependencies is not None else None
+        return self._path_dependencies[raw_path]
+    
+    def _get_lookup_cache_key(self, raw_path:str, node:BaseNode, current_data, root_data):
+        """
+        Key of a path lookup in the render-scoped cache: the object the path starts from, the path, 
+        and current values of variables (including index) used in its list index/slice, so that it changes when they change.
+        None if the path can't be cached.
+        """
+        dependencies = self._get_path_dependencies(raw_path)
+        if dependencies is None:
+            return None
+        dependency_values = tuple(self._find_nearest_ancestor_index(node) if name == ReservedWordEnum.Index.value 
+                                  else self._global_variable_dict.get(name) for name in dependencies)
+        return (id(_get_base_data(raw_path, current_data, root_data)), raw_path, dependency_values)
+    
+    def _find_nearest_ancestor_index(self, node:BaseNode):
+        _current_ancient_node:Optional[BaseNode] = node.father
+        while(_current_ancient_node is not None):
+            if _current_ancient_node.index is not None:
+                return _current_ancient_node.index
+            _current_ancient_node = _current_ancient_node.father
+        return None
+    
+    def _get_data_via_path(self, raw_path:str, node:BaseNode, current_data, root_data, is_checked:bool=True):
+        cache_key = self._get_lookup_cache_key(raw_path, node, current_data, root_data)
+        if cache_key is not None and cache_key in self._path_cache:
+            self.lookup_cache_stats["path_hits"] += 1
+            return self._path_cache[cache_key][1]
+        data = self._walk_data_path(raw_path, node, current_data, root_data, is_checked)
+        if cache_key is not None:
+            self.lookup_cache_stats["path_misses"] += 1
+            # Entry keeps the base data alive, so its id in the key can't be reused by another object while cached
+            self._path_cache[cache_key] = (_get_base_data(raw_path, current_data, root_data), data)
+        return data
     
-    def _get_data_via_path(self, raw_path:str, node:BaseNode, current_data, root_data):
+    def _get_length_via_path(self, raw_path:str, node:BaseNode, current_data, root_data, is_checked:bool=True):
+        cache_key = self._get_lookup_cache_key(raw_path, node, current_data, root_data)
+        if cache_key is not None and cache_key in self._len_cache:
+            self.lookup_cache_stats["len_hits"] += 1
+            return self._len_cache[cache_key][1]
+        length = len(self._get_data_via_path(raw_path, node, current_data, root_data, is_checked))
+        if cache_key is not None:
+            self.lookup_cache_stats["len_misses"] += 1
+            self._len_cache[cache_key] = (_get_base_data(raw_path, current_data, root_data), length)
+        return length
+    
+    def _walk_data_path_unchecked(self, raw_path:str, node:BaseNode, current_data, root_data):
+        """
+        Same as `_walk_data_path`, without type checks and error reporting, for batches passed `validate()`.
+        """
+        if raw_path.startswith('~.'):
+            path = raw_path[2:]
+            data = current_data
+        else:
+            path = raw_path
+            data = root_data
+        for sub_path in path.split('.'):
+            if sub_path == "":
+                continue
+            if sub_path[0] == '[' and sub_path[-1] == ']':
+                expression_like = sub_path[1:-1]
+                if expression_like == ReservedWordEnum.Reverse.value:
+                    data = list(reversed(data))
+                elif ':' in expression_like:
+                    _split = expression_like.split(":")
+                    start_index_expression = _split[0].strip()
+                    end_index_expression = _split[1].strip()
+                    start_index = eval(self._process_expression(start_index_expression, node, current_data, root_data, False)) if start_index_expression != '' else None
+                    end_index = eval(self._process_expression(end_index_expression, node, current_data, root_data, False)) if end_index_expression != '' else None
+                    # if start_index > end_index, will reverse the list
+                    if start_index is not None and end_index is not None and start_index > end_index:
+                        data = list(reversed(data[end_index+1:start_index+1]))
+                    else:
+                        data = data[start_index:end_index]
+                else:
+                    data = data[eval(self._process_expression(expression_like, node, current_data, root_data, False))]
+            else:
+                data = data[sub_path]
+        return data
+    
+    def _walk_data_path(self, raw_path:str, node:BaseNode, current_data, root_data, is_checked:bool=True):
+        if not is_checked:
+            return self._walk_data_path_unchecked(raw_path, node, current_data, root_data)
         index = node.Index
-        line_number = node.line_number
         # Relative path
         if raw_path.startswith('~.'):
             path = raw_path[2:]
@@ -183,22 +341,22 @@ class PmlParser():
                         if start_index_expression == '':
                             end_index = eval(self._process_expression(end_index_expression, node, current_data, root_data))
                             if type(end_index) is not int:
-                                raise ImproperTypeDataInListSliceError(line_number, end_index_expression, end_index, raw_path, type(end_index))
+                                raise ImproperTypeDataInListSliceError(node.line_number, end_index_expression, end_index, raw_path, type(end_index))
                             data = data[:end_index]
                         # right is empty, like [2:]
                         elif end_index_expression == '': 
                             start_index = eval(self._process_expression(start_index_expression, node, current_data, root_data))
-                            if type(end_index) is not int:
-                                raise ImproperTypeDataInListSliceError(line_number, start_index_expression, end_index, raw_path, type(end_index))
+                            if type(start_index) is not int:
+                                raise ImproperTypeDataInListSliceError(node.line_number, start_index_expression, start_index, raw_path, type(start_index))
                             data = data[start_index:]
                         # Range, like [2:3]
                         else:                        
                             start_index = eval(self._process_expression(start_index_expression, node, current_data, root_data))
                             if type(start_index) is not int:
-                                raise ImproperTypeDataInListSliceError(line_number, start_index_expression, start_index, raw_path, type(start_index))
+                                raise ImproperTypeDataInListSliceError(node.line_number, start_index_expression, start_index, raw_path, type(start_index))
                             end_index = eval(self._process_expression(end_index_expression, node, current_data, root_data))
                             if type(end_index) is not int:
-                                raise ImproperTypeDataInListSliceError(line_number, end_index_expression, end_index, raw_path, type(end_index))
+                                raise ImproperTypeDataInListSliceError(node.line_number, end_index_expression, end_index, raw_path, type(end_index))
                             # if start_index > end_index, will reverse the list
                             if start_index > end_index:
                                 start_index, end_index = end_index+1, start_index+1
@@ -211,11 +369,11 @@ class PmlParser():
                     else:
                         list_index = eval(self._process_expression(expression_like, node, current_data, root_data))
                         if type(list_index) is not int:
-                            raise ImproperTypeDataInListSliceError(line_number, expression_like, list_index, raw_path, type(list_index))
+                            raise ImproperTypeDataInListSliceError(node.line_number, expression_like, list_index, raw_path, type(list_index))
                         try:
                             data = data[list_index]                        
                         except IndexError as ie:
-                            raise ListOutOfIndexError(line_number, total_path, list_index, len(data), ".".join(already_found_path))
+                            raise ListOutOfIndexError(node.line_number, total_path, list_index, len(data), ".".join(already_found_path))
                     if is_reverse:                       
                         data = list(reversed(data))
                 except NameError as ne:
@@ -231,49 +389,79 @@ class PmlParser():
                     try:
                         data = data[path]
                     except KeyError as ke:
-                        raise PathNotFoundError(line_number, total_path, _original_sub_path, ".".join(already_found_path))
+                        raise PathNotFoundError(node.line_number, total_path, _original_sub_path, ".".join(already_found_path))
             already_found_path.append(_original_sub_path)
         return data
     
     # Pre-order fill data to tree
-    def _fill_data_to_sub_trees(self, tree:BaseNode, current_data, root_data, index:Optional[int]=None):
+    def _fill_data_to_sub_trees(self, tree:BaseNode, current_data, root_data, index:Optional[int]=None, is_checked:bool=True):
         tree.current_data = current_data
         if isinstance(tree, NonTerminalNode):
             child_index = 0
             while child_index < len(tree.children):
                 current_child = tree.children[child_index]        
                 if isinstance(current_child, LoopNode):
-                    loop_list = self._get_data_via_path(current_child.path, current_child, current_data, root_data)
-                    if not isinstance(loop_list, list):
+                    loop_list = self._get_data_via_path(current_child.path, current_child, current_data, root_data, is_checked)
+                    if is_checked and not isinstance(loop_list, list):
                         raise LoopPathNotListError(current_child.line_number, current_child.path)
                     current_child.is_processed = True
                     tree.children.pop(child_index)
+                    # Only items from start_index are filled (index still counts from the list head), see RenderSession
+                    start_index = current_child.start_index if current_child.start_index is not None else 0
+                    if start_index != 0:
+                        loop_list = loop_list[start_index:]
+                    self._render_loop_iterations += len(loop_list)
+                    is_parallel = self._is_parallel_loop(current_child, loop_list)
+                    parallel_nodes:list[EmptyNode] = []
                     # Copy len(loop_list) times, and insert them into the tree to replace the loop_start node
-                    for loop_index, loop_item in enumerate(loop_list):
-                        _empty_node = EmptyNode(line_number=current_child.line_number)
-                        _empty_node.children = copy.deepcopy(current_child.children)
+                    for loop_index, loop_item in enumerate(loop_list, start_index):
+                        _empty_node = EmptyNode().copy_position(current_child)
+                        # The copies of children get the new father directly, instead of copying all ancestors of the loop
+                        _empty_node.children = copy.deepcopy(current_child.children, {id(current_child): _empty_node})
                         _empty_node.father = tree
-                        # Give a new father to all children
-                        for _empty_node_child in _empty_node.children:
-                            _empty_node_child.father = _empty_node
                         _empty_node.index = loop_index # index in loop, will be used in IndexNode
                         tree.children.insert(child_index, _empty_node)
                         child_index += 1
+                        if is_parallel:
+                            parallel_nodes.append(_empty_node)
+                            continue
                         # fill sub tree data
-                        self._fill_data_to_sub_trees(_empty_node, loop_item, root_data, loop_index)
+                        self._fill_data_to_sub_trees(_empty_node, loop_item, root_data, loop_index, is_checked)
                         _empty_node.is_processed = True
+                    if is_parallel:
+                        self._fill_loop_iterations_in_parallel(parallel_nodes, loop_list, root_data, is_checked)
+                    # child_index already points to the node after the loop copies
+                    continue
+                elif isinstance(current_child, IfNode):
+                    condition = self._evaluate_condition(current_child, current_data, root_data, is_checked)
+                    # Replace the if by the taken branch, which is filled next as an EmptyNode. The other branch is dropped unevaluated
+                    current_child.is_processed = True
+                    taken_branch = current_child.ThenBranch if condition else current_child.ElseBranch
+                    taken_branch.father = tree
+                    tree.children[child_index] = taken_branch
+                    continue
                 # Deprecated
                 elif isinstance(current_child, DataNode):
-                    data = self._get_data_via_path(current_child.raw_text, current_child, current_data, root_data)
+                    data = self._get_data_via_path(current_child.raw_text, current_child, current_data, root_data, is_checked)
+                    current_child.data_path = current_child.raw_text
                     current_child.raw_text = str(data)
                     current_child.is_processed = True
+                elif isinstance(current_child, IncludeNode):
+                    try:
+                        self._fill_data_to_sub_trees(current_child, current_data, root_data, index, is_checked)
+                    except PMLBaseException as pe:
+                        # Line numbers inside the fragment are counted in the fragment file
+                        if pe.file_path is None:
+                            pe.file_path = current_child.file_path
+                        raise
+                    current_child.is_processed = True
                 elif isinstance(current_child, EmptyNode):
-                    self._fill_data_to_sub_trees(current_child, current_data, root_data, index)
+                    self._fill_data_to_sub_trees(current_child, current_data, root_data, index, is_checked)
                     current_child.is_processed = True
                 # Deprecated
                 elif type(current_child) is CalculationNode:
                     original_expression = current_child.expression
-                    current_child.expression = self._process_expression(current_child.expression, current_child, current_data, root_data)
+                    current_child.expression = self._process_expression(current_child.expression, current_child, current_data, root_data, is_checked)
                     try:
                         current_child.evaluate()
                         current_child.is_processed = True
@@ -285,7 +473,7 @@ class PmlParser():
                     original_expression = current_child.expression
                     if current_child.variable_name == ReservedWordEnum.Index.value:
                         raise AssignReadOnlyError(current_child.line_number, ReservedWordEnum.Index.value)
-                    current_child.expression = self._process_expression(current_child.expression, current_child, current_data, root_data)
+                    current_child.expression = self._process_expression(current_child.expression, current_child, current_data, root_data, is_checked)
                     # update global variable dict
                     try:
                         self._global_variable_dict[current_child.variable_name] = current_child.evaluate()
@@ -300,7 +488,8 @@ class PmlParser():
                     _match = re.match(FunctionPatternsEnum.Data.value, current_child.raw_text)
                     if _match and _match.group() == current_child.raw_text:
                         _path = _match.group().replace(KeywordEnum.Data.value, '')[1:-1]
-                        data = self._get_data_via_path(_path, current_child, current_data, root_data)
+                        data = self._get_data_via_path(_path, current_child, current_data, root_data, is_checked)
+                        current_child.data_path = _path
                         current_child.raw_text = str(data)
                         current_child.final_value = str(data)
                         current_child.is_processed = True
@@ -310,9 +499,10 @@ class PmlParser():
                         if success:
                             current_child.variable_name = variable_name
                             current_child.expression = expression
+                            original_expression = current_child.expression
                             if current_child.variable_name == ReservedWordEnum.Index.value:
                                 raise AssignReadOnlyError(current_child.line_number, ReservedWordEnum.Index.value)
-                            current_child.expression = self._process_expression(current_child.expression, current_child, current_data, root_data)
+                            current_child.expression = self._process_expression(current_child.expression, current_child, current_data, root_data, is_checked)
                             # update global variable dict
                             try:
                                 self._global_variable_dict[current_child.variable_name] = current_child.evaluate()
@@ -324,7 +514,8 @@ class PmlParser():
                         # Expression
                         else:
                             current_child.expression = current_child.raw_text
-                            current_child.expression = self._process_expression(current_child.expression, current_child, current_data, root_data)
+                            original_expression = current_child.expression
+                            current_child.expression = self._process_expression(current_child.expression, current_child, current_data, root_data, is_checked)
                             try:
                                 current_child.final_value = str(current_child.evaluate())
                             except NameError as ne:
@@ -334,40 +525,53 @@ class PmlParser():
                     current_child.is_processed = True
                 child_index += 1
                 
+    def _evaluate_condition(self, if_node:IfNode, current_data, root_data, is_checked:bool=True):
+        expression = self._process_expression(if_node.expression, if_node, current_data, root_data, is_checked, True)
+        try:
+            return bool(eval(expression))
+        except NameError as ne:
+            raise VariableReferenceError(if_node.line_number, ne.name)
+        except Exception as e:
+            raise ExpressionEvaluationUnknownExceptionError(if_node.line_number, if_node.expression, e)
+    
+    def _is_parallel_loop(self, loop_node:LoopNode, loop_list:list):
+        # With the GIL, threads filling iterations only take turns, which is slower than filling them in one thread
+        return self._max_loop_workers > 1 and loop_node.is_iteration_independent \
+            and len(loop_list) >= self._min_parallel_loop_iterations \
+            and not getattr(self._loop_thread_state, "is_in_parallel_loop", False) \
+            and not _is_gil_enabled()
+    
+    def _fill_loop_iterations(self, empty_nodes:list[EmptyNode], loop_list:list, root_data, is_checked:bool=True):
+        # Loops nested in a parallel iteration run sequentially in the worker, waiting on the same pool may dead lock
+        self._loop_thread_state.is_in_parallel_loop = True
+        try:
+            for empty_node, loop_item in zip(empty_nodes, loop_list):
+                self._fill_data_to_sub_trees(empty_node, loop_item, root_data, empty_node.index, is_checked)
+                empty_node.is_processed = True
+        finally:
+            self._loop_thread_state.is_in_parallel_loop = False
+    
+    def _fill_loop_iterations_in_parallel(self, empty_nodes:list[EmptyNode], loop_list:list, root_data, is_checked:bool=True):
+        """
+        Fill the copies of an independent loop body at the same time, in max_loop_workers contiguous chunks. 
+        They are already in the tree in order, so the output is the same as filling them one by one. 
+        The error of the first failed iteration is raised.
+        """
+        chunk_size = -(-len(empty_nodes) // self._max_loop_workers)
+        executor = _get_loop_executor()
+        futures = [executor.submit(self._fill_loop_iterations, empty_nodes[start:start+chunk_size], loop_list[start:start+chunk_size], root_data, is_checked) 
+                   for start in range(0, len(empty_nodes), chunk_size)]
+        for future in futures:
+            future.result()
+    
     def _try_decompose_assignment(self, raw_text:str):
         """
         Try to decompose assignment expression into variable name and expression. Will change "+=" to "=" and "-=" to "="
-
-        Args:
-            raw_text (str): 
-
-        Returns:
-            decompose_success (bool): Is decompose success
-            variable_name (str): Variable name on the left side of "="
-            expression (str): expression the right side of "="
-        """
-        decompose_success = False
-        splits = raw_text.split("+=")
-        if len(splits) == 2:
-            # is "+=", add variable name and '+' to the front of expression to change it from "+=" to "="
-            splits[1] = f"{splits[0].strip()} + {splits[1].strip()}"
-            decompose_success = True
-        else:
-            splits = raw_text.split("-=")
-            if len(splits) == 2:
-                # is "-=", add variable name and '-' to the front of expression to change it from "-=" to "="
-                splits[1] = f"{splits[0].strip()} - {splits[1].strip()}"
-                decompose_success = True
-            else:
-                splits = raw_text.split("=")
-                if len(splits) == 2:                    
-                    decompose_success = True
-        if decompose_success:
-            return decompose_success, splits[0].strip(), splits[1].strip()
-        else:
-            return decompose_success, None, None
+        See `prompt_tree_node.try_decompose_assignment`.
+        """
+        return try_decompose_assignment(raw_text)
         
-    def _process_expression(self, expression:str, node:BaseNode, current_data, root_data):
+    def _process_expression(self, expression:str, node:BaseNode, current_data, root_data, is_checked:bool=True, is_condition:bool=False):
         """
         Process variable reference and function call in expression, to make it ready for computation.
 
@@ -376,13 +580,16 @@ class PmlParser():
             node (BaseNode): Node using to track index, and provide line number for error
             current_data
             root_data
+            is_checked (bool): False in unchecked render, see `build_prompt_unchecked`
+            is_condition (bool): Whether expression is the condition of an if, where data can also be bool or None, and strings are quoted
 
         Returns:
             expression (str): Processed expression
         """
+        self._render_expression_evaluations += 1
         expression, node.index = self._process_index_in_expression(expression, node)
-        expression = self._process_len_in_expression(expression, node, current_data, root_data)
-        expression = self._process_data_in_expression(expression, node, current_data, root_data)
+        expression = self._process_len_in_expression(expression, node, current_data, root_data, is_checked)
+        expression = self._process_data_in_expression(expression, node, current_data, root_data, is_checked, is_condition)
         expression = self._process_global_variables_in_expression(expression, node.index)
         return expression
     
@@ -393,13 +600,7 @@ class PmlParser():
         index:Optional[int] = None
         for token in _tokens:
             if ReservedWordEnum.Index.value == token:
-                _nearest_ancient_index:Optional[int] = None
-                _current_ancient_node:BaseNode = node.father
-                while(_current_ancient_node is not None):
-                    if _current_ancient_node.index is not None:
-                        _nearest_ancient_index = _current_ancient_node.index
-                        break
-                    _current_ancient_node = _current_ancient_node.father
+                _nearest_ancient_index:Optional[int] = self._find_nearest_ancestor_index(node)
                 if _nearest_ancient_index is None:
                     raise VariableReferenceError(node.line_number, ReservedWordEnum.Index.value, f"Can't find {ReservedWordEnum.Index.value} in ancestors. Maybe you use a {ReservedWordEnum.Index.value} keyword outside of a loop?")
                 index = _nearest_ancient_index
@@ -434,66 +635,471 @@ class PmlParser():
                 return str(var_value)
         return token
     
-    def _process_len_in_expression(self, expression:str, node:BaseNode, current_data, root_data):
+    def _process_len_in_expression(self, expression:str, node:BaseNode, current_data, root_data, is_checked:bool=True):
         expression_copy = copy.deepcopy(expression)
-        line_number = node.line_number
         index = node.index
         # Replace length
         matches:list[str] = re.findall(FunctionPatternsEnum.Length.value, expression_copy)
         for match in matches:
             path = match.replace(ReservedWordEnum.Len.value, '')[1:-1]
-            _list = self._get_data_via_path(path, node, current_data, root_data)
-            length = len(_list)
+            length = self._get_length_via_path(path, node, current_data, root_data, is_checked)
             expression_copy = expression_copy.replace(match, str(length))
         return expression_copy
     
-    def _process_data_in_expression(self, expression:str, node:BaseNode, current_data, root_data):
+    def _process_data_in_expression(self, expression:str, node:BaseNode, current_data, root_data, is_checked:bool=True, is_condition:bool=False):
         expression_copy = copy.deepcopy(expression)
-        line_number = node.line_number
         index = node.index
         # Replace length
         matches:list[str] = re.findall(FunctionPatternsEnum.Data.value, expression_copy)
         for match in matches:
             path = match.replace(KeywordEnum.Data.value, '')[1:-1]
-            _data = self._get_data_via_path(path, node, current_data, root_data)
-            if type(_data) not in [int, float, str]:
-                raise ImproperTypeDataInExpressionError(line_number, expression, match,type(_data))
-            expression_copy = expression_copy.replace(match, str(_data))
+            _data = self._get_data_via_path(path, node, current_data, root_data, is_checked)
+            if is_checked and type(_data) not in ([int, float, str, bool, type(None)] if is_condition else [int, float, str]):
+                raise ImproperTypeDataInExpressionError(node.line_number, expression, match,type(_data))
+            # e.g. {if:data(name) == 'bob'}
+            if is_condition and type(_data) is str:
+                expression_copy = expression_copy.replace(match, repr(_data))
+            else:
+                expression_copy = expression_copy.replace(match, str(_data))
         return expression_copy
     
-    def _mark_line_number(self, word_list:list[str]):
-        line_number = 1
-        result:list[dict[str, int|str]] = []
-        for index, word in enumerate(word_list):
-            word_copy = copy.deepcopy(word)
-            old_line_number = line_number
-            # if a word starts with '\n', its line number should be counted after these '\n'
-            while (word_copy.startswith('\n')):
-                line_number += 1
-                word_copy = word_copy[1:]
-                # if this word is all '\n', we go back to the old line number, equal to the previous word
-                if word_copy == '':
-                    line_number = old_line_number
-                    word_copy = word
-                    break
-            result.append({"line": line_number, "word": word})
-            line_number += word_copy.count('\n')
+    def _mark_source_offsets(self, word_list:list[str]):
+        """
+        Returns:
+            list[int]: Offset of each word in template. If a word starts with '\n', the offset is counted after these '\n' 
+            (unless the word is all '\n'), so that its line number is the line its content is on.
+        """
+        offset = 0
+        result:list[int] = []
+        for word in word_list:
+            leading_newline_count = len(word) - len(word.lstrip('\n'))
+            result.append(offset + leading_newline_count if leading_newline_count < len(word) else offset)
+            offset += len(word)
         return result
     
     def _parse_syntax_tree(self):
         if self._is_clean_whitespace:
             self._template = self._clean_whitespace_at_the_end_of_lines(self._template)
         word_list:list[str] = self._template_tokenize(self._template)
-        word_list_with_line_number:list[dict[str, int|str]] = self._mark_line_number(word_list)
-        self._preprocess_invisible_keywords(word_list_with_line_number)
-        word_list_with_line_number = self._clean_empty_tokens(word_list_with_line_number)
+        offsets = self._mark_source_offsets(word_list)
+        self._preprocess_invisible_keywords(offsets, word_list)
+        offsets, word_list = self._clean_empty_tokens(offsets, word_list)
         decomposed_word_list:list[tuple[int, tuple[KeywordEnum, str|None]]] = \
-            [(pack['line'], self._decompose_tag_as_keyword_and_path(pack['word'])) for pack in word_list_with_line_number]
+            [(offset, self._decompose_tag_as_keyword_and_path(word)) for offset, word in zip(offsets, word_list)]
         root_node = EmptyNode()
-        parse_children(root_node, decomposed_word_list)        
+        parse_children(root_node, decomposed_word_list, SourceMap(self._template))        
+        template_real_path = os.path.realpath(self._template_path) if self._template_path is not None else None
+        with FRAGMENT_CACHE.loading(template_real_path):
+            self._resolve_includes(root_node)
         return root_node
+    
+    def _resolve_includes(self, node:BaseNode):
+        if not isinstance(node, NonTerminalNode):
+            return
+        # Relative to the directory of the template file, or the working directory if template is given as string
+        base_directory = os.path.dirname(os.path.abspath(self._template_path)) if self._template_path is not None else os.getcwd()
+        for child in node.children:
+            if isinstance(child, IncludeNode):
+                child.file_path = os.path.realpath(os.path.join(base_directory, child.path.strip()))
+                fragment = FRAGMENT_CACHE.get(child.file_path, child.line_number, self._is_clean_whitespace, self._is_reserve_comments, self._is_optimize)
+                child.children = fragment.children
+            else:
+                self._resolve_includes(child)
         
-    def build_prompt(self, **data):
-        tree = copy.deepcopy(self.template_tree)
-        self._fill_data_to_sub_trees(tree, data, data, None)
+    def _fill_data_to_tree(self, tree:BaseNode, data:dict, is_checked:bool=True):
+        if self._is_lookup_cache_shared:
+            self._fill_data_to_sub_trees(tree, data, data, None, is_checked)
+            return
+        self._path_cache.clear()
+        self._len_cache.clear()
+        try:
+            self._fill_data_to_sub_trees(tree, data, data, None, is_checked)
+        finally:
+            # Don't keep references to the data after render
+            self._path_cache.clear()
+            self._len_cache.clear()
+    
+    @contextlib.contextmanager
+    def _use_lookup_caches(self, path_cache:dict, len_cache:dict):
+        """
+        Look up paths and len() in the given caches, which are not cleared by each render, so they can be shared by 
+        several parsers rendering the same data. Keys include the variables a path depends on, so sharing is safe.
+        The caller should clear them when the data is done.
+        """
+        own_caches = (self._path_cache, self._len_cache)
+        self._path_cache, self._len_cache = path_cache, len_cache
+        self._is_lookup_cache_shared = True
+        try:
+            yield
+        finally:
+            self._path_cache, self._len_cache = own_caches
+            self._is_lookup_cache_shared = False
+    
+    def _render_tree(self, tree:BaseNode, data:dict, is_checked:bool=True):
+        """
+        Fill data into a copied tree and return the prompt. Not reported to METRICS by itself, see _measuring_render.
+        """
+        self._fill_data_to_tree(tree, data, is_checked)
         return tree.PromptString
+    
+    @contextlib.contextmanager
+    def _measuring_render(self):
+        """
+        Report one render to METRICS (if enabled) for what is built inside, however many parts the prompt is built in.
+        Yields a list, append the prompt (or its parts) to it for the output size. Nested measurements are part of the outer one.
+        """
+        if self._render_depth > 0 or not METRICS.is_enabled:
+            self._render_depth += 1
+            try:
+                yield []
+            finally:
+                self._render_depth -= 1
+            return
+        self._render_loop_iterations = 0
+        self._render_expression_evaluations = 0
+        start_time = time.perf_counter()
+        lookup_cache_stats_before = dict(self.lookup_cache_stats)
+        output_parts:list[str] = []
+        self._render_depth += 1
+        try:
+            yield output_parts
+        finally:
+            self._render_depth -= 1
+        METRICS.observe("render_seconds", time.perf_counter() - start_time, template=self.name)
+        METRICS.observe("output_bytes", sum(len(part.encode('utf-8')) for part in output_parts), BYTES_BUCKETS, template=self.name)
+        METRICS.increase("loop_iterations_total", self._render_loop_iterations, template=self.name)
+        METRICS.increase("expression_evaluations_total", self._render_expression_evaluations, template=self.name)
+        for key, value in self.lookup_cache_stats.items():
+            # e.g. "path_hits" -> kind "path", result "hits"
+            kind, result = key.split('_')
+            METRICS.increase("lookup_cache_total", value - lookup_cache_stats_before[key], template=self.name, kind=kind, result=result)
+    
+    def _build_prompt_of_children(self, children:list[BaseNode], data:dict):
+        """
+        Fill data into a copy of some children of the template tree root, and return their prompt.
+        """
+        tree = EmptyNode()
+        # Map the template root to the new root, so that deepcopy won't copy the whole template tree through "father"
+        tree.children = copy.deepcopy(children, {id(self.template_tree): tree})
+        return self._render_tree(tree, data)
+    
+    def bind_static_data(self, **static_data):
+        """
+        Bind data that stays the same across renders (e.g. in-context samples), so that the output depending only on it 
+        can be counted into the static prefix of `build_prompt_with_static_prefix`.
+
+        Args:
+            **static_data: Same as `build_prompt`, these keys should not be given again when building prompt.
+        """
+        self._static_data = static_data
+        self._static_prefix_cache = None
+    
+    def _build_prompt_of_part(self, container:NonTerminalNode, children:list[BaseNode], data:dict):
+        """
+        Fill data into a copy of some children of a node at root level (the root, an include, or a taken if branch), and return their prompt.
+        """
+        if len(children) == 0:
+            return ""
+        tree = EmptyNode()
+        if isinstance(container, IncludeNode):
+            # Keep the include, so errors in it still report the fragment file
+            part = IncludeNode(container.path, father=tree).copy_position(container)
+            part.file_path = container.file_path
+            part.children = children
+            tree.children = [copy.deepcopy(part, {id(tree): tree})]
+        else:
+            tree.children = copy.deepcopy(children, {id(container): tree})
+        return self._render_tree(tree, data)
+    
+    def _build_static_prefix(self, container:NonTerminalNode, analyzer:StaticAnalyzer, data:dict, prefix_parts:list[str], suffix_starts:list[tuple[NonTerminalNode, int]]):
+        """
+        Build the output of container up to its first node depending on per-query data, looking into includes, and the taken branch 
+        of ifs with a static condition (evaluated after the output before it is built, so the variables are up to date).
+
+        Args:
+            prefix_parts: Output of the static part is appended to it.
+            suffix_starts: If a dynamic node is found, (container, index of first child in suffix) of it and every container above it are appended, innermost first.
+
+        Returns:
+            bool: Whether the whole container is static.
+        """
+        children = container.children
+        start = 0
+        for index, child in enumerate(children):
+            if isinstance(child, IfNode) and analyzer.is_expression_static(child.expression):
+                prefix_parts.append(self._build_prompt_of_part(container, children[start:index], data))
+                is_taken = self._evaluate_condition(child, data, data)
+                # Outside of a render, don't keep references to the data
+                self._path_cache.clear()
+                self._len_cache.clear()
+                branch = child.ThenBranch if is_taken else child.ElseBranch
+                is_static = self._build_static_prefix(branch, analyzer, data, prefix_parts, suffix_starts)
+            elif isinstance(child, EmptyNode):
+                prefix_parts.append(self._build_prompt_of_part(container, children[start:index], data))
+                is_static = self._build_static_prefix(child, analyzer, data, prefix_parts, suffix_starts)
+            elif analyzer.is_node_static(child):
+                continue
+            else:
+                prefix_parts.append(self._build_prompt_of_part(container, children[start:index], data))
+                suffix_starts.append((container, index))
+                return False
+            if not is_static:
+                suffix_starts.append((container, index+1))
+                return False
+            start = index + 1
+        prefix_parts.append(self._build_prompt_of_part(container, children[start:], data))
+        return True
+    
+    def build_prompt_with_static_prefix(self, **data):
+        """
+        Build prompt, but split it into the leading part that does not depend on the given data, and the rest.
+        The static prefix is only built once per template (and per `bind_static_data` call), then reused.
+
+        Returns:
+            static_prefix (str): Output of the leading template part that only depends on the template and the bound static data.
+            prefix_hash (str): SHA-256 hex digest of static_prefix, can be used as key of prefix cache.
+            dynamic_suffix (str): The rest of the prompt. static_prefix + dynamic_suffix == build_prompt(**data)
+        """
+        duplicated_keys = self._static_data.keys() & data.keys()
+        if len(duplicated_keys) != 0:
+            raise ValueError(f"Data {sorted(duplicated_keys)} is already bound as static data.")
+        data = {**self._static_data, **data}
+        with self._measuring_render() as output_parts:
+            if self._static_prefix_cache is None:
+                prefix_parts:list[str] = []
+                suffix_starts:list[tuple[NonTerminalNode, int]] = []
+                self._build_static_prefix(self.template_tree, StaticAnalyzer(self._static_data.keys()), data, prefix_parts, suffix_starts)
+                static_prefix = "".join(prefix_parts)
+                prefix_hash = hashlib.sha256(static_prefix.encode('utf-8')).hexdigest()
+                self._static_prefix_cache = (static_prefix, prefix_hash, dict(self._global_variable_dict), suffix_starts)
+            static_prefix, prefix_hash, variables_after_prefix, suffix_starts = self._static_prefix_cache
+            # Variables assigned in the prefix should be visible in the suffix
+            self._global_variable_dict.update(variables_after_prefix)
+            # The rest of the innermost container first, then the rest of the containers above it
+            dynamic_suffix = "".join(self._build_prompt_of_part(container, container.children[start:], data) for container, start in suffix_starts)
+            output_parts.extend([static_prefix, dynamic_suffix])
+        return static_prefix, prefix_hash, dynamic_suffix
+    
+    def _prefill_data_columns(self, columns:dict[str, list], n_rows:int):
+        """
+        Convert top level data tags with a plain key path (e.g. "{data:query.text}") to strings column by column,
+        instead of resolving them row by row.
+
+        Returns:
+            dict[int, list[str]]: index in children of template root -> string of each row
+        """
+        prefilled:dict[int, list[str]] = {}
+        for child_index, child in enumerate(self.template_tree.children):
+            if isinstance(child, DataNode):
+                path = child.raw_text
+            elif type(child) is PrintNode and re.fullmatch(FunctionPatternsEnum.Data.value, child.raw_text.strip()):
+                path = child.raw_text.strip().replace(KeywordEnum.Data.value, '')[1:-1]
+            else:
+                continue
+            # At root, relative path is the same as absolute path
+            if path.startswith('~.'):
+                path = path[2:]
+            path_list = path.split('.')
+            if path_list[0] not in columns or '[' in path:
+                continue
+            try:
+                column_strings:list[str] = []
+                for value in columns[path_list[0]][:n_rows]:
+                    for key in path_list[1:]:
+                        value = value[key] if key != "" else value
+                    column_strings.append(str(value))
+            # Leave it to row by row render, to raise the usual error
+            except (KeyError, TypeError, IndexError):
+                continue
+            prefilled[child_index] = column_strings
+        return prefilled
+    
+    def render_columns(self, columns:dict, n_rows:int, output:Optional[IO[str]]=None, separator:str="\n"):
+        """
+        Build n_rows prompts from data in columns, the i-th prompt is built with {name: column[i] for each column}.
+        Top level data tags are converted to string once per column, and each row only gets the columns the rest of the template reads.
+
+        Args:
+            columns (dict): Column name -> equal-length list (or NumPy array) of values. Names are the keyword arguments of `build_prompt`.
+            n_rows (int): Number of prompts to build.
+            output (Optional[IO[str]]): If given, prompts are written to it, each followed by separator, instead of being returned.
+            separator (str): Written after each prompt when output is given.
+
+        Returns:
+            list[str]: Prompts, or None if output is given.
+        """
+        # NumPy arrays are converted to lists of python objects at once
+        columns = {name: column.tolist() if hasattr(column, "tolist") else column for name, column in columns.items()}
+        for name, column in columns.items():
+            if len(column) < n_rows:
+                raise ValueError(f'Column "{name}" has {len(column)} rows, but {n_rows} rows are required.')
+        prefilled = self._prefill_data_columns(columns, n_rows)
+        rest_children = [child for child_index, child in enumerate(self.template_tree.children) if child_index not in prefilled]
+        used_names = RootDataNameCollector().collect(rest_children)
+        if used_names is None:
+            used_names = set(columns.keys())
+        used_columns = {name: column for name, column in columns.items() if name in used_names}
+        prompts:list[str] = []
+        for row in range(n_rows):
+            row_children = list(self.template_tree.children)
+            for child_index, column_strings in prefilled.items():
+                row_children[child_index] = PlainTextNode(column_strings[row]).copy_position(row_children[child_index])
+            with self._measuring_render() as output_parts:
+                prompt = self._build_prompt_of_children(row_children, {name: column[row] for name, column in used_columns.items()})
+                output_parts.append(prompt)
+            if output is not None:
+                output.write(prompt)
+                output.write(separator)
+            else:
+                prompts.append(prompt)
+        return prompts if output is None else None
+    
+    def validate(self, sample_records:list[dict]):
+        """
+        Build prompt with every record in checked mode, so any error of the batch is raised as usual,
+        and check all records have the same top level keys. After that, `build_prompt_unchecked` can be used for records of the same shape.
+
+        Args:
+            sample_records (list[dict]): Each record is the keyword arguments of `build_prompt`.
+        """
+        self._validated_keys = None
+        if len(sample_records) == 0:
+            raise ValueError("At least one sample record is required for validation.")
+        keys = frozenset(sample_records[0].keys())
+        for record in sample_records:
+            if record.keys() != keys:
+                raise RecordNotValidatedError(sorted(record.keys()), sorted(keys))
+            self.build_prompt(**record)
+        self._validated_keys = keys
+    
+    def build_prompt_unchecked(self, **data):
+        """
+        Same as `build_prompt`, but skips type checks and error reporting at every node.
+        Only for trusted data of the same shape as the records given to `validate()`, otherwise the error raised is a plain python error.
+        Only the top level keys are checked (RecordNotValidatedError if they differ), the mode is passed down the render so
+        other threads rendering with the same parser stay checked.
+        """
+        if self._validated_keys is None or data.keys() != self._validated_keys:
+            raise RecordNotValidatedError(sorted(data.keys()), sorted(self._validated_keys) if self._validated_keys is not None else None)
+        with self._measuring_render() as output_parts:
+            prompt = self._render_tree(copy.deepcopy(self.template_tree), data, False)
+            output_parts.append(prompt)
+        return prompt
+    
+    def build_prompt_with_spans(self, **data):
+        """
+        Build prompt, and record where the value of each data tag ("{data:path}" or "{print:data(path)}") is in it.
+
+        Returns:
+            prompt (str): Same as `build_prompt(**data)`
+            spans (SpanMap): (start, end, template_line, path, loop_indices) of each value, in order of the prompt.
+        """
+        with self._measuring_render() as output_parts:
+            tree = copy.deepcopy(self.template_tree)
+            prompt = self._render_tree(tree, data)
+            output_parts.append(prompt)
+        return prompt, SpanMap.from_tree(tree)
+    
+    def build_prompt(self, **data):
+        with self._measuring_render() as output_parts:
+            prompt = self._render_tree(copy.deepcopy(self.template_tree), data)
+            output_parts.append(prompt)
+        return prompt
+
+
+def _get_base_data(raw_path:str, current_data, root_data):
+    return current_data if raw_path.startswith('~.') else root_data
+
+def _is_gil_enabled():
+    # sys._is_gil_enabled only exists since Python 3.13, the GIL is always enabled before
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is None or is_gil_enabled()
+
+# Thread pool shared by all parsers to fill loop iterations, created on first use
+_LOOP_EXECUTOR:Optional[ThreadPoolExecutor] = None
+_LOOP_EXECUTOR_LOCK = threading.Lock()
+
+def _get_loop_executor():
+    global _LOOP_EXECUTOR
+    with _LOOP_EXECUTOR_LOCK:
+        if _LOOP_EXECUTOR is None:
+            _LOOP_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="PmlLoopWorker")
+        return _LOOP_EXECUTOR
+
+
+class FragmentCache():
+    """
+    Parsed trees of included fragments, shared by all templates including them. 
+    A fragment is parsed again only if its file, or any file it includes (directly or not), is modified.
+    """
+    def __init__(self) -> None:
+        # (real path, is_clean_whitespace, is_reserve_comments, is_optimize) -> (mtime in ns of the fragment and all files it includes, parsed tree)
+        self._fragments:dict[tuple[str, bool, bool, bool], tuple[dict[str, int], EmptyNode]] = {}
+        self._lock = threading.Lock()
+        # Files being parsed in current thread, used to detect include cycle
+        self._local = threading.local()
+        
+    @property
+    def _loading_stack(self) -> list[str]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+    
+    @contextlib.contextmanager
+    def loading(self, file_path:Optional[str]):
+        if file_path is None:
+            yield
+            return
+        self._loading_stack.append(file_path)
+        try:
+            yield
+        finally:
+            self._loading_stack.pop()
+    
+    def get(self, file_path:str, line_number:int, is_clean_whitespace_at_the_end_of_lines:bool=False, is_reserve_comments:bool=False, is_optimize:bool=True):
+        loading_stack = self._loading_stack
+        if file_path in loading_stack:
+            raise IncludeCycleError(line_number, loading_stack[loading_stack.index(file_path):] + [file_path])
+        if not os.path.isfile(file_path):
+            raise IncludeFileNotFoundError(line_number, file_path)
+        mtime = os.stat(file_path).st_mtime_ns
+        key = (file_path, is_clean_whitespace_at_the_end_of_lines, is_reserve_comments, is_optimize)
+        with self._lock:
+            cached = self._fragments.get(key)
+        if cached is not None and _are_files_unchanged(cached[0]):
+            if METRICS.is_enabled:
+                METRICS.increase("fragment_cache_total", result="hits")
+            return cached[1]
+        if METRICS.is_enabled:
+            METRICS.increase("fragment_cache_total", result="misses")
+        try:
+            # The fragment parser resolves nested includes inside loading(file_path)
+            fragment = PmlParser(template_path=file_path, 
+                                 is_clean_whitespace_at_the_end_of_lines=is_clean_whitespace_at_the_end_of_lines, 
+                                 is_reserve_comments=is_reserve_comments,
+                                 is_optimize=is_optimize).template_tree
+        except PMLBaseException as pe:
+            if pe.file_path is None:
+                pe.file_path = file_path
+            raise
+        file_mtimes = {file_path: mtime}
+        for included_path in collect_included_files(fragment):
+            file_mtimes[included_path] = os.stat(included_path).st_mtime_ns
+        with self._lock:
+            self._fragments[key] = (file_mtimes, fragment)
+        return fragment
+    
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+            
+def _are_files_unchanged(file_mtimes:dict[str, int]):
+    for file_path, mtime in file_mtimes.items():
+        try:
+            if os.stat(file_path).st_mtime_ns != mtime:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+            
+FRAGMENT_CACHE = FragmentCache()
@@ -1,7 +1,9 @@
+import copy
 from typing import Optional, Union
 
 from .keyword_enum import KeywordEnum
-from .Errors import LoopKeywordUnpairedError
+from .source_map import SourceMap
+from .Errors import IfKeywordUnpairedError, LoopKeywordUnpairedError
 
 
 DEFAULT_ERROR_VALUE = 2333
@@ -13,9 +15,32 @@ class BaseNode:
         self.father:Optional[BaseNode] = father
         self.current_data = None
         self.index:Optional[int] = None # Only used for loop
-        self.line_number:int = line_number
+        self._line_number:int = line_number
+        # Nodes from parsing only keep the offset in template, line number is counted when needed
+        self.source_offset:int = -1
+        self.source_map:Optional[SourceMap] = None
         self.is_processed:bool = False # Is already filled with data
         
+    @property
+    def line_number(self):
+        if self.source_map is not None:
+            return self.source_map.line_of(self.source_offset)
+        return self._line_number
+    
+    @line_number.setter
+    def line_number(self, value:int):
+        self._line_number = value
+        self.source_map = None
+        
+    def copy_position(self, node:'BaseNode'):
+        """
+        Use the same position in template as node, without counting its line number.
+        """
+        self._line_number = node._line_number
+        self.source_offset = node.source_offset
+        self.source_map = node.source_map
+        return self
+        
     @property
     def Index(self):
         return self.index
@@ -80,6 +105,7 @@ class EmptyNode(NonTerminalNode): # Used for empty Non-Terminal Node
 class DataNode(TerminalNode):
     def __init__(self, text_or_path:str, father:Optional['BaseNode']=None, line_number:int=-1) -> None:
         super().__init__(text_or_path, father, line_number)
+        self.data_path:Optional[str] = None # Set when filled, raw_text is then replaced by the data
         
 class PlainTextNode(TerminalNode):
     def __init__(self, text_or_path:str, father:Optional['BaseNode']=None, line_number:int=-1) -> None:
@@ -186,9 +212,44 @@ class PrintNode(TerminalNode):
 class LoopNode(NonTerminalNode):
     def __init__(self, text_or_path:str, father:Optional['BaseNode']=None, line_number:int=-1) -> None:
         super().__init__(text_or_path, father, line_number)
-        self.start_index:Optional[int] = None
+        self.start_index:Optional[int] = None # Skip items before it, used to render only new items of a growing list
         self.end_index:Optional[int] = None
+        # No variable is written in the loop body, so iterations can be filled in any order, see mark_independent_loops
+        self.is_iteration_independent:bool = False
+        
+class IfNode(NonTerminalNode):
+    # Always has 2 children: the branch taken if the condition is true, and the else branch (may be empty).
+    # When filling data, it is replaced by the taken branch before the branch is filled, so the other branch is never evaluated
+    def __init__(self, expression:str, father:Optional['BaseNode']=None, line_number:int=-1) -> None:
+        super().__init__(expression, father, line_number)
+        self.expression = expression
+        
+    @property
+    def ThenBranch(self) -> EmptyNode:
+        return self.children[0]
+    
+    @property
+    def ElseBranch(self) -> EmptyNode:
+        return self.children[1]
+        
+class IncludeNode(EmptyNode):
+    # Children are shared with the parsed fragment, see FragmentCache
+    def __init__(self, text_or_path:str, father:Optional['BaseNode']=None, line_number:int=-1) -> None:
+        super().__init__(text_or_path, father, line_number)
+        self.file_path:Optional[str] = None # Resolved absolute path of the fragment
         
+    def __deepcopy__(self, memo:dict):
+        # Children are shared by all includes of the same fragment, but every copy must own its children,
+        # so they are copied with a fresh memo, and their father (the fragment root) is replaced by the copy
+        new_node = copy.copy(self)
+        memo[id(self)] = new_node
+        new_node.father = copy.deepcopy(self.father, memo)
+        children_memo:dict = {id(self): new_node}
+        for child in self.children:
+            children_memo[id(child.father)] = new_node
+        new_node.children = [copy.deepcopy(child, children_memo) for child in self.children]
+        return new_node
+    
 class CommentNode(TerminalNode):
     def __init__(self, comment:str, father:Optional['BaseNode']=None, line_number:int=-1) -> None:
         super().__init__(comment, father, line_number)
@@ -197,53 +258,153 @@ class CommentNode(TerminalNode):
     def PromptString(self):
         return ""
     
-def find_outer_paired_loop_end_index(decomposed_lst:list[tuple[int, tuple[KeywordEnum, str]]]):
-    loop_start_stack:list[tuple[int, tuple[KeywordEnum, str]]] = []
+def collect_included_files(node:BaseNode, result:Optional[set[str]]=None):
+    """
+    Returns:
+        set[str]: Resolved paths of all fragments included under node, including those included by fragments.
+    """
+    if result is None:
+        result = set()
+    if isinstance(node, NonTerminalNode):
+        for child in node.children:
+            if isinstance(child, IncludeNode) and child.file_path is not None:
+                result.add(child.file_path)
+            collect_included_files(child, result)
+    return result
+    
+def try_decompose_assignment(raw_text:str):
+    """
+    Try to decompose assignment expression into variable name and expression. Will change "+=" to "=" and "-=" to "="
+
+    Args:
+        raw_text (str): 
+
+    Returns:
+        decompose_success (bool): Is decompose success
+        variable_name (str): Variable name on the left side of "="
+        expression (str): expression the right side of "="
+    """
+    decompose_success = False
+    splits = raw_text.split("+=")
+    if len(splits) == 2:
+        # is "+=", add variable name and '+' to the front of expression to change it from "+=" to "="
+        splits[1] = f"{splits[0].strip()} + {splits[1].strip()}"
+        decompose_success = True
+    else:
+        splits = raw_text.split("-=")
+        if len(splits) == 2:
+            # is "-=", add variable name and '-' to the front of expression to change it from "-=" to "="
+            splits[1] = f"{splits[0].strip()} - {splits[1].strip()}"
+            decompose_success = True
+        else:
+            splits = raw_text.split("=")
+            if len(splits) == 2:                    
+                decompose_success = True
+    if decompose_success:
+        return decompose_success, splits[0].strip(), splits[1].strip()
+    else:
+        return decompose_success, None, None
+    
+def find_outer_paired_loop_end_index(decomposed_lst:list[tuple[int, tuple[KeywordEnum, str]]], source_map:SourceMap, start_index:int=0):
+    """
+    Find the end paired with the outer block start (loop or if) at start_index. Also check all block keywords in the list are paired,
+    and every else is directly inside an if, at most once.
+
+    Args:
+        decomposed_lst: (offset in template, (keyword type, text)) of each token
+        source_map: Used to get line number of offset for error
+        start_index: Index of the block start, which should not be inside another block
+    """
+    # Open blocks, and whether each one has met its else
+    block_start_stack:list[tuple[int, tuple[KeywordEnum, str]]] = []
+    has_else_stack:list[bool] = []
     found_index = -1
     for index, element in enumerate(decomposed_lst):
-        (line_number, (keyword_type, text)) = element
-        if keyword_type == KeywordEnum.LoopStart:
-            loop_start_stack.append(element)
+        (offset, (keyword_type, text)) = element
+        if keyword_type in (KeywordEnum.LoopStart, KeywordEnum.If):
+            block_start_stack.append(element)
+            has_else_stack.append(False)
+        elif keyword_type == KeywordEnum.Else:
+            if len(block_start_stack) == 0 or block_start_stack[-1][1][0] != KeywordEnum.If or has_else_stack[-1]:
+                raise IfKeywordUnpairedError(source_map.line_of(offset), '{'+KeywordEnum.Else.value+'}')
+            has_else_stack[-1] = True
         elif keyword_type == KeywordEnum.LoopEnd:
-            if len(loop_start_stack) == 0:
-                raise LoopKeywordUnpairedError(line_number, '{'+KeywordEnum.LoopEnd.value+'}')
+            if len(block_start_stack) == 0:
+                raise LoopKeywordUnpairedError(source_map.line_of(offset), '{'+KeywordEnum.LoopEnd.value+'}')
             else:
-                loop_start_stack.pop()
-            if len(loop_start_stack) == 0:
+                block_start_stack.pop()
+                has_else_stack.pop()
+            # The first time all blocks are closed after the block start, is its paired end. Later blocks are siblings
+            if len(block_start_stack) == 0 and found_index == -1 and index > start_index:
                 found_index = index
-    if len(loop_start_stack) != 0:
-        line_number = loop_start_stack[0][0]
-        text = loop_start_stack[0][1][1]
-        raise LoopKeywordUnpairedError(line_number, '{'+f"{KeywordEnum.LoopStart.value}:{text}"+'}')
+    if len(block_start_stack) != 0:
+        line_number = source_map.line_of(block_start_stack[0][0])
+        keyword_type, text = block_start_stack[0][1]
+        error_type = LoopKeywordUnpairedError if keyword_type == KeywordEnum.LoopStart else IfKeywordUnpairedError
+        raise error_type(line_number, '{'+f"{keyword_type.value}:{text}"+'}')
     return found_index
+
+def find_else_index(decomposed_lst:list[tuple[int, tuple[KeywordEnum, str]]]):
+    """
+    Returns:
+        int: Index of the else not inside any block, -1 if there is none. decomposed_lst is the body of an if, already checked as paired.
+    """
+    depth = 0
+    for index, (_, (keyword_type, _)) in enumerate(decomposed_lst):
+        if keyword_type in (KeywordEnum.LoopStart, KeywordEnum.If):
+            depth += 1
+        elif keyword_type == KeywordEnum.LoopEnd:
+            depth -= 1
+        elif keyword_type == KeywordEnum.Else and depth == 0:
+            return index
+    return -1
     
-def parse_children(node:BaseNode, children_list:list[tuple[int, tuple[KeywordEnum, str]]]):
+def parse_children(node:BaseNode, children_list:list[tuple[int, tuple[KeywordEnum, str]]], source_map:SourceMap):
     if not isinstance(node, NonTerminalNode):
         return
     # Only NonTerminalNode can have children
     skips_index:list = []
-    for index, (line_number, (keyword_type, text)) in enumerate(children_list):
+    for index, (offset, (keyword_type, text)) in enumerate(children_list):
         if index in skips_index:
             continue
         # Skip the loop end keyword, it will not appear in the tree
         if keyword_type == KeywordEnum.LoopEnd:
             continue
+        # else of an if is already consumed when splitting the if body
+        elif keyword_type == KeywordEnum.Else:
+            raise IfKeywordUnpairedError(source_map.line_of(offset), '{'+KeywordEnum.Else.value+'}')
         elif keyword_type == KeywordEnum.Data:
-            child_node:BaseNode = DataNode(father=node, text_or_path=text, line_number=line_number)
+            child_node:BaseNode = DataNode(father=node, text_or_path=text)
         elif keyword_type == KeywordEnum.PlainText:
-            child_node = PlainTextNode(father=node, text_or_path=text, line_number=line_number)
+            child_node = PlainTextNode(father=node, text_or_path=text)
         elif keyword_type == KeywordEnum.Calculation:
-            child_node = CalculationNode(father=node, expression=text, line_number=line_number)
+            child_node = CalculationNode(father=node, expression=text)
         elif keyword_type == KeywordEnum.Assignment:
-            child_node = AssignmentNode(father=node, raw_text=text, line_number=line_number)
+            child_node = AssignmentNode(father=node, raw_text=text)
         elif keyword_type == KeywordEnum.Print:
-            child_node = PrintNode(father=node, raw_text=text, line_number=line_number)
+            child_node = PrintNode(father=node, raw_text=text)
         elif keyword_type == KeywordEnum.LoopStart:
-            child_node = LoopNode(father=node, text_or_path=text, line_number=line_number)
+            child_node = LoopNode(father=node, text_or_path=text)
         elif keyword_type == KeywordEnum.Comment:
-            child_node = CommentNode(father=node, comment=text, line_number=line_number)
+            child_node = CommentNode(father=node, comment=text)
+        elif keyword_type == KeywordEnum.Include:
+            child_node = IncludeNode(father=node, text_or_path=text)
+        elif keyword_type == KeywordEnum.If:
+            child_node = IfNode(father=node, expression=text)
+        child_node.source_offset = offset
+        child_node.source_map = source_map
         node.children.append(child_node)
         if keyword_type == KeywordEnum.LoopStart:
-            loop_end_index = find_outer_paired_loop_end_index(children_list)
+            loop_end_index = find_outer_paired_loop_end_index(children_list, source_map, index)
             skips_index.extend(range(index, loop_end_index+1))
-            parse_children(child_node, children_list[index+1:loop_end_index])
\ No newline at end of file
+            parse_children(child_node, children_list[index+1:loop_end_index], source_map)
+        elif keyword_type == KeywordEnum.If:
+            if_end_index = find_outer_paired_loop_end_index(children_list, source_map, index)
+            skips_index.extend(range(index, if_end_index+1))
+            body = children_list[index+1:if_end_index]
+            else_index = find_else_index(body)
+            then_node = EmptyNode(father=child_node).copy_position(child_node)
+            else_node = EmptyNode(father=child_node).copy_position(child_node)
+            child_node.children = [then_node, else_node]
+            parse_children(then_node, body if else_index == -1 else body[:else_index], source_map)
+            parse_children(else_node, [] if else_index == -1 else body[else_index+1:], source_map)
@@ -0,0 +1,176 @@
+import copy
+from typing import Optional
+
+from .pml_parser import PmlParser
+from .prompt_tree_node import BaseNode, LoopNode, NonTerminalNode
+from .static_analysis import RootDataNameCollector, VariableNameCollector, get_assignment
+
+
+# Snapshot of a value that can't be copied, never the same as the value
+_NO_SNAPSHOT = object()
+
+
+class RenderSession():
+    """
+    Render the same template again and again with a list that only grows at its tail, e.g. turns of a chat transcript.
+
+    The last top level loop of the template over a top level list (e.g. "{loop:turns}", writing no variable) is the growing loop.
+    The template before it, and its body (except through "~."), should not read the list, e.g. by "len(turns)".
+    If since the previous render, only new items are appended to its list, the kept items and the other data are equal to
+    their values at the previous render, and the global variables the kept output depends on are unchanged,
+    only the new items and the template after the loop are rendered.
+    Otherwise the whole template is rendered.
+    """
+    def __init__(self, parser:PmlParser) -> None:
+        self._parser = parser
+        self._loop_child_index:Optional[int] = None
+        self._loop_data_name:Optional[str] = None
+        children = parser.template_tree.children
+        for child_index, child in enumerate(children):
+            if isinstance(child, LoopNode) and child.is_iteration_independent:
+                path = child.path[2:] if child.path.startswith('~.') else child.path
+                if path != "" and '.' not in path and '[' not in path and not _reads_whole_list(children[:child_index], child, path):
+                    self._loop_child_index = child_index
+                    self._loop_data_name = path
+        # Variables whose values at render start decide the kept output and the variables at loop start, see _get_start_reads
+        self._start_read_names:set[str] = set()
+        self._prefix_assigned_names:set[str] = set()
+        if self._loop_child_index is not None:
+            self._start_read_names, self._prefix_assigned_names = _get_start_reads(children[:self._loop_child_index], children[self._loop_child_index])
+        self.reset()
+
+    @property
+    def parser(self):
+        return self._parser
+
+    def reset(self):
+        """
+        Forget the previous render, the next render will render the whole template.
+        """
+        # Snapshots of the data of the kept output: items of the list rendered so far, and the other data
+        self._previous_data:Optional[dict] = None
+        self._previous_loop_items:list = []
+        # Variables read at render start by the kept output, and variables assigned before the loop, when the kept output was rendered
+        self._start_read_variables:dict = {}
+        self._prefix_assigned_variables:dict = {}
+        # Prompt before the loop and of all rendered loop items, it doesn't change while the list grows
+        self._stable_prefix:str = ""
+        self.is_last_render_incremental:bool = False
+
+    def _is_appended(self, data:dict, start_read_variables:dict):
+        if self._previous_data is None or self._loop_data_name is None:
+            return False
+        if data.keys() - {self._loop_data_name} != self._previous_data.keys() or not _is_same(start_read_variables, self._start_read_variables):
+            return False
+        for key, previous_value in self._previous_data.items():
+            if not _is_same(data[key], previous_value):
+                return False
+        loop_items = data.get(self._loop_data_name)
+        previous_count = len(self._previous_loop_items)
+        if not isinstance(loop_items, list) or len(loop_items) < previous_count:
+            return False
+        return all(_is_same(item, previous_item) for item, previous_item in zip(loop_items, self._previous_loop_items))
+
+    def render(self, **data):
+        """
+        Args:
+            **data: Same as `PmlParser.build_prompt`
+
+        Returns:
+            full_prompt (str): Same as `PmlParser.build_prompt(**data)`
+            new_suffix (str): Part of full_prompt after what stays unchanged since the previous render.
+                              It is full_prompt if the whole template is rendered.
+        """
+        parser = self._parser
+        if self._loop_child_index is None:
+            full_prompt = parser.build_prompt(**data)
+            self.is_last_render_incremental = False
+            return full_prompt, full_prompt
+        # Counted as one render, though it is built in parts
+        with parser._measuring_render() as output_parts:
+            children = parser.template_tree.children
+            loop_node = children[self._loop_child_index]
+            # Variables not assigned yet are left out
+            start_read_variables = {name: parser._global_variable_dict[name] for name in self._start_read_names if name in parser._global_variable_dict}
+            self.is_last_render_incremental = self._is_appended(data, start_read_variables)
+            if self.is_last_render_incremental:
+                stable_prefix = self._stable_prefix
+                rendered_count = len(self._previous_loop_items)
+                # Same as the template before the loop would assign. The loop writes no variable, so the template after it sees them too
+                parser._global_variable_dict.update(self._prefix_assigned_variables)
+            else:
+                # Forgotten until the whole render succeeds
+                self.reset()
+                stable_prefix = parser._build_prompt_of_children(children[:self._loop_child_index], data)
+                prefix_assigned_variables = {name: parser._global_variable_dict[name] for name in self._prefix_assigned_names
+                                             if name in parser._global_variable_dict}
+                rendered_count = 0
+            # Its children need the new loop node as father, to find the loop index
+            new_loop_node = copy.deepcopy(loop_node, {id(parser.template_tree): parser.template_tree})
+            new_loop_node.start_index = rendered_count
+            new_items_prompt = parser._build_prompt_of_children([new_loop_node], data)
+            after_loop_prompt = parser._build_prompt_of_children(children[self._loop_child_index+1:], data)
+            if not self.is_last_render_incremental:
+                self._previous_data = {key: _snapshot(value) for key, value in data.items() if key != self._loop_data_name}
+                self._start_read_variables = _snapshot(start_read_variables)
+                self._prefix_assigned_variables = prefix_assigned_variables
+            self._stable_prefix = stable_prefix + new_items_prompt
+            # Only the new items are copied, the kept ones are equal to their snapshots
+            self._previous_loop_items.extend(_snapshot(item) for item in data[self._loop_data_name][rendered_count:])
+            full_prompt = self._stable_prefix + after_loop_prompt
+            new_suffix = full_prompt if not self.is_last_render_incremental else new_items_prompt + after_loop_prompt
+            output_parts.append(full_prompt)
+        return full_prompt, new_suffix
+
+def _reads_whole_list(children_before_loop:list[BaseNode], loop_node:LoopNode, data_name:str):
+    """
+    Whether output kept from the previous render may change when the list grows: the template before the loop,
+    or the body of rendered items, reads the list (or the whole data) by absolute path, len() or data().
+    """
+    names_before_loop = RootDataNameCollector().collect(children_before_loop)
+    # Relative paths in the body read the item
+    names_in_body = RootDataNameCollector().collect(loop_node.children, True)
+    return any(names is None or data_name in names for names in [names_before_loop, names_in_body])
+
+def _get_start_reads(children_before_loop:list[BaseNode], loop_node:LoopNode):
+    """
+    Returns:
+        start_read_names (set[str]): Variables whose values at render start may change the output of the template before the loop,
+            of the loop body, or the variables at loop start. A variable assigned at the top level before the loop is only counted
+            if it is read before that assignment. A variable assigned in a loop or an if may not be assigned, so it is always counted.
+        prefix_assigned_names (set[str]): Variables the template before the loop may assign.
+    """
+    start_read_names:set[str] = set()
+    assigned_names:set[str] = set()
+    for child in children_before_loop:
+        start_read_names.update(VariableNameCollector().collect([child]) - assigned_names)
+        assignment = get_assignment(child)
+        if assignment is not None:
+            assigned_names.add(assignment[0])
+    prefix_assigned_names = _collect_assigned_names(children_before_loop)
+    start_read_names.update(VariableNameCollector().collect(loop_node.children) - assigned_names)
+    start_read_names.update(prefix_assigned_names - assigned_names)
+    return start_read_names, prefix_assigned_names
+
+def _collect_assigned_names(nodes:list[BaseNode]):
+    names:set[str] = set()
+    for node in nodes:
+        assignment = get_assignment(node)
+        if assignment is not None:
+            names.add(assignment[0])
+        elif isinstance(node, NonTerminalNode):
+            names.update(_collect_assigned_names(node.children))
+    return names
+
+def _snapshot(value):
+    """
+    Copy of value to compare with later, so changes made in place since are seen.
+    """
+    try:
+        return copy.deepcopy(value)
+    except Exception:
+        return _NO_SNAPSHOT
+
+def _is_same(value, snapshot):
+    # Compared by value, not identity: the same object may have been changed in place
+    return snapshot is not _NO_SNAPSHOT and value == snapshot
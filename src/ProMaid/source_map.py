@@ -0,0 +1,26 @@
+from bisect import bisect_left
+
+
+class SourceMap():
+    """
+    Newline offsets of a template, to turn a character offset into line and column only when needed (e.g. to raise an error).
+    Immutable, so it is shared (not copied) by all nodes parsed from the same template.
+    """
+    def __init__(self, template:str) -> None:
+        self._newline_offsets:list[int] = [offset for offset, char in enumerate(template) if char == '\n']
+
+    def line_of(self, offset:int) -> int:
+        # 1-based, number of '\n' before offset + 1
+        return bisect_left(self._newline_offsets, offset) + 1
+
+    def position_of(self, offset:int) -> tuple[int, int]:
+        """
+        Returns:
+            (line, column), both 1-based.
+        """
+        line = self.line_of(offset)
+        line_start = self._newline_offsets[line-2] + 1 if line > 1 else 0
+        return line, offset - line_start + 1
+
+    def __deepcopy__(self, memo:dict):
+        return self
@@ -0,0 +1,75 @@
+from array import array
+from typing import Iterator
+
+from .prompt_tree_node import BaseNode, DataNode, NonTerminalNode, PrintNode
+
+
+class SpanMap():
+    """
+    Where each data value (from "{data:path}" or "{print:data(path)}") landed in a built prompt.
+    Span i is (start, end, template_line, path, loop_indices): prompt[start:end] is the value, template_line is the line of the tag
+    (counted in the fragment file if it is in an included fragment), loop_indices are indexes of the enclosing loops, outermost first.
+
+    Stored as parallel integer arrays. Paths are stored once each, and loop indices of all spans are concatenated into one array.
+    """
+    def __init__(self) -> None:
+        self.starts:array = array('q')
+        self.ends:array = array('q')
+        self.template_lines:array = array('i')
+        self.path_ids:array = array('i')
+        self.paths:list[str] = []
+        self._path_to_id:dict[str, int] = {}
+        # Loop indices of span i are loop_indices[loop_indices_offsets[i]:loop_indices_offsets[i+1]]
+        self.loop_indices:array = array('q')
+        self.loop_indices_offsets:array = array('q', [0])
+
+    def append(self, start:int, end:int, template_line:int, path:str, loop_indices:tuple[int, ...]):
+        if path not in self._path_to_id:
+            self._path_to_id[path] = len(self.paths)
+            self.paths.append(path)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.template_lines.append(template_line)
+        self.path_ids.append(self._path_to_id[path])
+        self.loop_indices.extend(loop_indices)
+        self.loop_indices_offsets.append(len(self.loop_indices))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, index:int):
+        if index < 0:
+            index += len(self)
+        loop_indices = tuple(self.loop_indices[self.loop_indices_offsets[index]:self.loop_indices_offsets[index+1]])
+        return self.starts[index], self.ends[index], self.template_lines[index], self.paths[self.path_ids[index]], loop_indices
+
+    def __iter__(self) -> Iterator[tuple[int, int, int, str, tuple[int, ...]]]:
+        for index in range(len(self)):
+            yield self[index]
+
+    @classmethod
+    def from_tree(cls, tree:BaseNode):
+        """
+        Collect spans from a tree already filled with data, in the same order as `PromptString` concatenates it.
+        """
+        span_map = cls()
+        span_map._collect(tree, 0, ())
+        return span_map
+
+    def _collect(self, node:BaseNode, offset:int, loop_indices:tuple[int, ...]) -> int:
+        """
+        Returns:
+            int: Offset after the output of node.
+        """
+        if isinstance(node, NonTerminalNode):
+            # Copies of a loop body carry the loop index
+            if node.index is not None:
+                loop_indices = loop_indices + (node.index,)
+            for child in node.children:
+                offset = self._collect(child, offset, loop_indices)
+            return offset
+        # Same as the f-string concatenation of NonTerminalNode.PromptString
+        end = offset + len(str(node.PromptString))
+        if isinstance(node, (DataNode, PrintNode)) and node.data_path is not None:
+            self.append(offset, end, node.line_number, node.data_path, loop_indices)
+        return end
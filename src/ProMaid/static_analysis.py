@@ -0,0 +1,339 @@
+import keyword
+import re
+from typing import Iterable, Optional, Union
+
+from .keyword_enum import KeywordEnum, ReservedWordEnum, FunctionPatternsEnum
+from .prompt_tree_node import AssignmentNode, BaseNode, CalculationNode, CommentNode, DataNode, IfNode, IncludeNode, LoopNode, NonTerminalNode, PlainTextNode, PrintNode, TerminalNode, try_decompose_assignment
+
+
+IDENTIFIER_PATTERN = r"\b[^\W\d]\w*"
+# Builtins that are safe to call while deciding a value without the data: no I/O, no side effect
+PURE_BUILTIN_NAMES:set[str] = {"int", "float", "str", "bool", "abs", "round", "min", "max", "pow", "divmod"}
+
+class StaticAnalyzer:
+    """
+    Decide which nodes of a template tree produce the same output no matter what data is given to `build_prompt`.
+
+    Data under `fixed_data_names` is treated as known in advance (i.e. bound once, reused by every render).
+    Variables assigned from static expressions become static themselves, in document order.
+    """
+    def __init__(self, fixed_data_names:Iterable[str]=(), static_variables:Iterable[str]=()) -> None:
+        self.fixed_data_names:set[str] = set(fixed_data_names)
+        self.static_variables:set[str] = set(static_variables)
+
+    def is_path_static(self, path:str, loop_state:Optional[bool]=None) -> bool:
+        """
+        Args:
+            path (str): data path, e.g. "~.interaction.[0].utterance"
+            loop_state (Optional[bool]): None if the path is outside any loop; True if inside a static loop; False if inside a data dependent loop.
+        """
+        if path.startswith('~.'):
+            path = path[2:]
+            # Context of a loop is the loop item
+            if loop_state is not None:
+                if not loop_state:
+                    return False
+                return self._are_path_brackets_static(path.split('.'), loop_state)
+        # Absolute path (or relative path at root, which is the same)
+        path_list = path.split('.')
+        if path_list[0] not in self.fixed_data_names:
+            return False
+        return self._are_path_brackets_static(path_list[1:], loop_state)
+
+    def _are_path_brackets_static(self, path_list:list[str], loop_state:Optional[bool]) -> bool:
+        for sub_path in path_list:
+            if sub_path.startswith('[') and sub_path.endswith(']'):
+                expression_like = sub_path[1:-1]
+                if expression_like == ReservedWordEnum.Reverse.value:
+                    continue
+                for expression in expression_like.split(':'):
+                    if expression.strip() != '' and not self.is_expression_static(expression, loop_state):
+                        return False
+        return True
+
+    def is_expression_static(self, expression:str, loop_state:Optional[bool]=None) -> bool:
+        for pattern in [FunctionPatternsEnum.Length.value, FunctionPatternsEnum.Data.value]:
+            for match in re.findall(pattern, expression):
+                path = match[match.index('(')+1:-1]
+                if not self.is_path_static(path, loop_state):
+                    return False
+                expression = expression.replace(match, '0')
+        for name in re.findall(IDENTIFIER_PATTERN, expression):
+            if name == ReservedWordEnum.Index.value:
+                # index changes with iteration, only static if the whole loop is static
+                if not loop_state:
+                    return False
+            elif name not in self.static_variables and name not in PURE_BUILTIN_NAMES and not keyword.iskeyword(name):
+                return False
+        return True
+
+    def _track_assignment(self, variable_name:str, expression:str, loop_state:Optional[bool]) -> bool:
+        if variable_name == ReservedWordEnum.Index.value:
+            return False
+        if self.is_expression_static(expression, loop_state):
+            self.static_variables.add(variable_name)
+            return True
+        self.static_variables.discard(variable_name)
+        return False
+
+    def is_node_static(self, node:BaseNode, loop_state:Optional[bool]=None) -> bool:
+        """
+        Check whether a node (and all its children) is static. Static assignments met on the way are remembered.
+        """
+        if isinstance(node, (PlainTextNode, CommentNode)):
+            return True
+        elif isinstance(node, DataNode):
+            return self.is_path_static(node.raw_text, loop_state)
+        elif type(node) is AssignmentNode:
+            return self._track_assignment(node.variable_name, node.expression, loop_state)
+        elif type(node) is CalculationNode:
+            return self.is_expression_static(node.expression, loop_state)
+        elif type(node) is PrintNode:
+            raw_text = node.raw_text.strip()
+            _match = re.match(FunctionPatternsEnum.Data.value, raw_text)
+            if _match and _match.group() == raw_text:
+                return self.is_path_static(raw_text.replace(KeywordEnum.Data.value, '')[1:-1], loop_state)
+            success, variable_name, expression = try_decompose_assignment(raw_text)
+            if success:
+                return self._track_assignment(variable_name, expression, loop_state)
+            return self.is_expression_static(raw_text, loop_state)
+        elif isinstance(node, LoopNode):
+            if not self.is_path_static(node.path, loop_state):
+                return False
+            return all(self.is_node_static(child, True) for child in node.children)
+        elif isinstance(node, IfNode):
+            if not self.is_expression_static(node.expression, loop_state):
+                return False
+            return all(self.is_node_static(child, loop_state) for child in node.children)
+        elif isinstance(node, NonTerminalNode):
+            return all(self.is_node_static(child, loop_state) for child in node.children)
+        return False
+
+def get_assignment(node:BaseNode):
+    """
+    Returns:
+        (variable_name, expression) if the node is an assignment ({var:} or {print:} with assignment), else None
+    """
+    if type(node) is AssignmentNode:
+        return node.variable_name, node.expression
+    if type(node) is PrintNode:
+        success, variable_name, expression = try_decompose_assignment(node.raw_text.strip())
+        if success:
+            return variable_name, expression
+    return None
+
+def mark_independent_loops(node:BaseNode):
+    """
+    Set `is_iteration_independent` of every loop under node. Returns whether node has state writes.
+    """
+    if get_assignment(node) is not None:
+        return True
+    if not isinstance(node, NonTerminalNode):
+        return False
+    has_writes = False
+    for child in node.children:
+        # Not short-circuit, every loop should be marked
+        has_writes = mark_independent_loops(child) or has_writes
+    if isinstance(node, LoopNode):
+        node.is_iteration_independent = not has_writes
+    return has_writes
+
+class ConstantFolder:
+    """
+    Parse-time optimization of a template tree:
+    1. Nodes printing an expression of literals and constant variables are evaluated once and replaced by plain text. 
+       A constant variable is assigned only once in the whole template, outside any loop or if, from a constant expression,
+       and it is only folded after that assignment.
+    2. An if with a constant condition is replaced by the taken branch.
+    3. Comments are dropped, consecutive plain text is merged into one node.
+
+    Children of included fragments are shared with other templates, so they are never modified here 
+    (the fragment is optimized when it is parsed itself).
+    """
+    def __init__(self) -> None:
+        self.folded_node_count:int = 0
+        self.eliminated_node_count:int = 0
+        self._constants:dict[str, Union[int, float, str]] = {}
+        self._assignment_counts:dict[str, int] = {}
+        self._analyzer = StaticAnalyzer()
+
+    def optimize(self, root:NonTerminalNode):
+        self._count_assignments(root)
+        self._fold(root, None)
+        self._coalesce(root)
+
+    def _count_assignments(self, node:BaseNode):
+        assignment = get_assignment(node)
+        if assignment is not None:
+            self._assignment_counts[assignment[0]] = self._assignment_counts.get(assignment[0], 0) + 1
+        if isinstance(node, NonTerminalNode):
+            for child in node.children:
+                self._count_assignments(child)
+
+    def _try_evaluate(self, expression:str, loop_state:Optional[bool]):
+        """
+        Returns:
+            (success, value)
+        """
+        if not self._analyzer.is_expression_static(expression, loop_state):
+            return False, None
+        expression = re.sub(IDENTIFIER_PATTERN, lambda match: str(self._constants.get(match.group(), match.group())), expression)
+        try:
+            value = eval(expression)
+            # Folded values are printed, and some can't be, e.g. an int with too many digits
+            str(value)
+            return True, value
+        # Let render raise the error with the usual error type
+        except Exception:
+            return False, None
+
+    def _fold(self, node:NonTerminalNode, loop_state:Optional[bool]):
+        for child_index, child in enumerate(node.children):
+            if isinstance(child, IfNode):
+                success, value = self._try_evaluate(child.expression, loop_state)
+                if not success:
+                    # Like in a loop, assignments in a branch may not happen, so they are not constant
+                    self._fold(child, False)
+                    continue
+                child = child.ThenBranch if value else child.ElseBranch
+                child.father = node
+                node.children[child_index] = child
+                self.folded_node_count += 1
+            assignment = get_assignment(child)
+            if assignment is not None:
+                variable_name, expression = assignment
+                # Only the assignment itself stays in tree, it still updates the variable at render
+                if loop_state is None and self._assignment_counts[variable_name] == 1:
+                    success, value = self._try_evaluate(expression, loop_state)
+                    if success:
+                        self._constants[variable_name] = value
+                        self._analyzer.static_variables.add(variable_name)
+            elif type(child) is CalculationNode or (type(child) is PrintNode and not re.fullmatch(FunctionPatternsEnum.Data.value, child.raw_text.strip())):
+                expression = child.expression if type(child) is CalculationNode else child.raw_text.strip()
+                success, value = self._try_evaluate(expression, loop_state)
+                if success:
+                    node.children[child_index] = PlainTextNode(str(value), father=node).copy_position(child)
+                    self.folded_node_count += 1
+            elif isinstance(child, LoopNode):
+                self._fold(child, False)
+            elif isinstance(child, NonTerminalNode) and not isinstance(child, IncludeNode):
+                self._fold(child, loop_state)
+
+    def _coalesce(self, node:NonTerminalNode):
+        new_children:list[BaseNode] = []
+        for child in node.children:
+            if isinstance(child, CommentNode) or (type(child) is PlainTextNode and child.raw_text == ""):
+                self.eliminated_node_count += 1
+                continue
+            if type(child) is PlainTextNode and len(new_children) > 0 and type(new_children[-1]) is PlainTextNode:
+                new_children[-1].raw_text += child.raw_text
+                self.eliminated_node_count += 1
+                continue
+            new_children.append(child)
+            if isinstance(child, NonTerminalNode) and not isinstance(child, IncludeNode):
+                self._coalesce(child)
+        node.children = new_children
+
+class RootDataNameCollector:
+    """
+    Collect names of the top level data (keyword arguments of `build_prompt`) that a template reads.
+    `names` is None if the whole data is used, e.g. by "{data:}".
+    """
+    def __init__(self) -> None:
+        self.names:Optional[set[str]] = set()
+
+    def collect(self, nodes:list[BaseNode], is_in_loop:bool=False):
+        for node in nodes:
+            if isinstance(node, DataNode):
+                self._collect_path(node.raw_text, is_in_loop)
+            elif type(node) is AssignmentNode or type(node) is CalculationNode:
+                self._collect_expression(node.expression, is_in_loop)
+            elif type(node) is PrintNode:
+                raw_text = node.raw_text.strip()
+                if re.fullmatch(FunctionPatternsEnum.Data.value, raw_text):
+                    self._collect_path(raw_text.replace(KeywordEnum.Data.value, '')[1:-1], is_in_loop)
+                else:
+                    self._collect_expression(raw_text, is_in_loop)
+            elif isinstance(node, LoopNode):
+                self._collect_path(node.path, is_in_loop)
+                self.collect(node.children, True)
+            elif isinstance(node, IfNode):
+                self._collect_expression(node.expression, is_in_loop)
+                self.collect(node.children, is_in_loop)
+            elif isinstance(node, NonTerminalNode):
+                self.collect(node.children, is_in_loop)
+        return self.names
+
+    def _collect_path(self, path:str, is_in_loop:bool):
+        is_relative = path.startswith('~.')
+        path_list = (path[2:] if is_relative else path).split('.')
+        # Relative path in a loop starts from the loop item
+        if not (is_relative and is_in_loop):
+            if path_list[0] == '':
+                self.names = None
+            elif self.names is not None:
+                self.names.add(path_list[0])
+        for sub_path in path_list:
+            if sub_path.startswith('[') and sub_path.endswith(']'):
+                self._collect_expression(sub_path[1:-1], is_in_loop)
+
+    def _collect_expression(self, expression:str, is_in_loop:bool):
+        for pattern in [FunctionPatternsEnum.Length.value, FunctionPatternsEnum.Data.value]:
+            for match in re.findall(pattern, expression):
+                self._collect_path(match[match.index('(')+1:-1], is_in_loop)
+
+class VariableNameCollector:
+    """
+    Collect names of global variables that nodes read (index excluded).
+    Any other identifier in an expression is counted too, so the result may be larger than the real one, never smaller.
+    """
+    def __init__(self) -> None:
+        self.names:set[str] = set()
+
+    def collect(self, nodes:list[BaseNode]):
+        for node in nodes:
+            if isinstance(node, DataNode):
+                self._collect_path(node.raw_text)
+            elif type(node) is AssignmentNode or type(node) is CalculationNode:
+                self._collect_expression(node.expression)
+            elif type(node) is PrintNode:
+                raw_text = node.raw_text.strip()
+                if re.fullmatch(FunctionPatternsEnum.Data.value, raw_text):
+                    self._collect_path(raw_text.replace(KeywordEnum.Data.value, '')[1:-1])
+                else:
+                    assignment = get_assignment(node)
+                    self._collect_expression(assignment[1] if assignment is not None else raw_text)
+            elif isinstance(node, LoopNode):
+                self._collect_path(node.path)
+                self.collect(node.children)
+            elif isinstance(node, IfNode):
+                self._collect_expression(node.expression)
+                self.collect(node.children)
+            elif isinstance(node, NonTerminalNode):
+                self.collect(node.children)
+        return self.names
+
+    def _collect_path(self, path:str):
+        for sub_path in path.split('.'):
+            if sub_path.startswith('[') and sub_path.endswith(']') and sub_path[1:-1] != ReservedWordEnum.Reverse.value:
+                for expression in sub_path[1:-1].split(':'):
+                    self._collect_expression(expression)
+
+    def _collect_expression(self, expression:str):
+        for pattern in [FunctionPatternsEnum.Length.value, FunctionPatternsEnum.Data.value]:
+            for match in re.findall(pattern, expression):
+                self._collect_path(match[match.index('(')+1:-1])
+                expression = expression.replace(match, '0')
+        self.names.update(name for name in re.findall(IDENTIFIER_PATTERN, expression)
+                          if name != ReservedWordEnum.Index.value and name not in PURE_BUILTIN_NAMES and not keyword.iskeyword(name))
+
+def get_subtree_signature(node:BaseNode):
+    """
+    Hashable structure of a parsed (not filled) subtree: nodes with the same signature give the same output from the same data and variables,
+    even if they are in different templates.
+    """
+    if isinstance(node, NonTerminalNode):
+        return (type(node).__name__, node.path, tuple(get_subtree_signature(child) for child in node.children))
+    if isinstance(node, TerminalNode):
+        return (type(node).__name__, node.raw_text)
+    return (type(node).__name__,)
@@ -0,0 +1,93 @@
+import copy
+
+from .pml_parser import PmlParser
+from .prompt_tree_node import BaseNode, LoopNode
+from .static_analysis import VariableNameCollector, get_subtree_signature
+
+
+class TemplateGroup():
+    """
+    Render the same data with several templates (e.g. variants of a prompt), sharing work between them:
+    1. Paths and len() are looked up once per data for the whole group, instead of once per template.
+    2. A top level loop that is the same in several templates, writes no variable and reads no variable, is rendered once per data.
+    """
+    def __init__(self, parsers:dict[str, PmlParser]) -> None:
+        """
+        Args:
+            parsers (dict[str, PmlParser]): Name -> parser, e.g. {name: registry[name] for name in registry.names}
+        """
+        self._parsers = dict(parsers)
+        # Signature of each shareable loop, by name of template and index in children of template root
+        self._loop_signatures:dict[str, dict[int, tuple]] = {}
+        signature_counts:dict[tuple, int] = {}
+        for name, parser in self._parsers.items():
+            self._loop_signatures[name] = {}
+            for child_index, child in enumerate(parser.template_tree.children):
+                if isinstance(child, LoopNode) and child.is_iteration_independent and len(VariableNameCollector().collect([child])) == 0:
+                    signature = get_subtree_signature(child)
+                    self._loop_signatures[name][child_index] = signature
+                    signature_counts[signature] = signature_counts.get(signature, 0) + 1
+        # Only worth rendering apart from the rest of the template if another template has the same loop
+        for name, loop_signatures in self._loop_signatures.items():
+            self._loop_signatures[name] = {child_index: signature for child_index, signature in loop_signatures.items()
+                                           if signature_counts[signature] > 1}
+        self.shared_loop_stats:dict[str, int] = {"hits": 0, "misses": 0}
+
+    @property
+    def names(self):
+        return list(self._parsers.keys())
+
+    def render(self, **data):
+        """
+        Args:
+            **data: Same as `PmlParser.build_prompt`
+
+        Returns:
+            dict[str, str]: Name -> prompt, the same as `parser.build_prompt(**data)` of each template.
+        """
+        # Every template is given this same data dict, so lookups from the root data have the same key in all templates
+        path_cache:dict[tuple, tuple[object, object]] = {}
+        len_cache:dict[tuple, tuple[object, int]] = {}
+        loop_prompts:dict[tuple, str] = {}
+        prompts:dict[str, str] = {}
+        try:
+            for name, parser in self._parsers.items():
+                with parser._use_lookup_caches(path_cache, len_cache):
+                    prompts[name] = self._render_template(name, parser, data, loop_prompts)
+        finally:
+            # Don't keep references to the data after render
+            path_cache.clear()
+            len_cache.clear()
+        return prompts
+
+    def _render_template(self, name:str, parser:PmlParser, data:dict, loop_prompts:dict[tuple, str]):
+        loop_signatures = self._loop_signatures[name]
+        if len(loop_signatures) == 0:
+            # Not parser.build_prompt(**data), which would get a new dict as root data
+            with parser._measuring_render() as output_parts:
+                prompt = parser._render_tree(copy.deepcopy(parser.template_tree), data)
+                output_parts.append(prompt)
+            return prompt
+        # Children between shared loops are rendered together, variables assigned in them stay in the parser for the next part.
+        # Counted as one render of the template
+        with parser._measuring_render() as output_parts:
+            pieces:list[str] = []
+            segment:list[BaseNode] = []
+            for child_index, child in enumerate(parser.template_tree.children):
+                if child_index not in loop_signatures:
+                    segment.append(child)
+                    continue
+                if len(segment) != 0:
+                    pieces.append(parser._build_prompt_of_children(segment, data))
+                    segment = []
+                signature = loop_signatures[child_index]
+                if signature in loop_prompts:
+                    self.shared_loop_stats["hits"] += 1
+                else:
+                    self.shared_loop_stats["misses"] += 1
+                    loop_prompts[signature] = parser._build_prompt_of_children([child], data)
+                pieces.append(loop_prompts[signature])
+            if len(segment) != 0:
+                pieces.append(parser._build_prompt_of_children(segment, data))
+            output_parts.extend(pieces)
+        return "".join(pieces)
@@ -0,0 +1,191 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import sys
+import threading
+import time
+from typing import Optional
+
+from .pml_parser import PmlParser
+from .prompt_tree_node import BaseNode, collect_included_files
+from .Errors import PMLBaseException
+
+
+class ReloadReport():
+    def __init__(self) -> None:
+        self.reloaded_names:list[str] = []
+        self.removed_names:list[str] = []
+        # Name -> error, the old parser is still served for these templates
+        self.failed_names:dict[str, Exception] = {}
+        self.seconds:float = 0.0
+        self.memory_bytes:int = 0 # Estimated size of all parsed template trees after reload
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(reloaded={self.reloaded_names}, removed={self.removed_names}, failed={list(self.failed_names)}, seconds={self.seconds:.4f}, memory_bytes={self.memory_bytes})"
+
+class _TemplateEntry():
+    def __init__(self, parser:PmlParser, content_hash:str, file_mtimes:dict[str, int]) -> None:
+        self.parser = parser
+        self.content_hash = content_hash
+        # mtime of template file and all files it includes
+        self.file_mtimes = file_mtimes
+
+class TemplateRegistry():
+    """
+    Load all PML templates in a directory and serve their parsers by name.
+    Name is the path relative to the directory without suffix, with "/" as separator, e.g. "sparc/sub_dataset".
+    Call `refresh()` (or `start_watching()`) to re-parse only the changed templates.
+    """
+    SUFFIXES:tuple[str, ...] = (".pml", ".PML")
+
+    def __init__(self,
+                 directory:str,
+                 is_clean_whitespace_at_the_end_of_lines:bool=False,
+                 is_reserve_comments:bool=False,
+                 max_workers:Optional[int]=None
+                 ) -> None:
+        self._directory = os.path.abspath(directory)
+        self._is_clean_whitespace = is_clean_whitespace_at_the_end_of_lines
+        self._is_reserve_comments = is_reserve_comments
+        self._max_workers = max_workers
+        # Replaced as a whole on reload, so readers never see a half updated registry
+        self._entries:dict[str, _TemplateEntry] = {}
+        self._refresh_lock = threading.Lock()
+        self._watch_thread:Optional[threading.Thread] = None
+        self._stop_watching_event = threading.Event()
+        self.last_report:Optional[ReloadReport] = None
+        report = self.refresh()
+        if len(report.failed_names) != 0:
+            raise next(iter(report.failed_names.values()))
+
+    @property
+    def names(self):
+        return sorted(self._entries.keys())
+
+    def get(self, name:str) -> PmlParser:
+        return self._entries[name].parser
+
+    def __getitem__(self, name:str) -> PmlParser:
+        return self.get(name)
+
+    def __contains__(self, name:str) -> bool:
+        return name in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_name(self, path:str):
+        return os.path.splitext(os.path.relpath(path, self._directory))[0].replace(os.sep, "/")
+
+    def _scan_files(self):
+        name_to_path:dict[str, str] = {}
+        for root, _, files in os.walk(self._directory):
+            for file in files:
+                if file.endswith(self.SUFFIXES):
+                    path = os.path.join(root, file)
+                    name_to_path[self._get_name(path)] = path
+        return name_to_path
+
+    def _is_changed(self, file_mtimes:dict[str, int]):
+        for file_path, mtime in file_mtimes.items():
+            try:
+                if os.stat(file_path).st_mtime_ns != mtime:
+                    return True
+            except FileNotFoundError:
+                return True
+        return False
+
+    def _load(self, path:str, old_entry:Optional[_TemplateEntry]):
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, 'rb') as file:
+            content_hash = hashlib.sha256(file.read()).hexdigest()
+        # Only touched: same content and no included fragment changed, the parser is still up to date
+        if old_entry is not None and old_entry.content_hash == content_hash \
+            and not self._is_changed({k: v for k, v in old_entry.file_mtimes.items() if k != path}):
+            return _TemplateEntry(old_entry.parser, content_hash, {**old_entry.file_mtimes, path: mtime}), False
+        parser = PmlParser(template_path=path,
+                           is_clean_whitespace_at_the_end_of_lines=self._is_clean_whitespace,
+                           is_reserve_comments=self._is_reserve_comments,
+                           name=self._get_name(path))
+        file_mtimes = {path: mtime}
+        for included_path in collect_included_files(parser.template_tree):
+            file_mtimes[included_path] = os.stat(included_path).st_mtime_ns
+        return _TemplateEntry(parser, content_hash, file_mtimes), True
+
+    def refresh(self) -> ReloadReport:
+        """
+        Re-parse templates whose file (or included fragment) was added or modified, drop removed ones,
+        then swap in the new set of parsers at once. A template failed to re-parse keeps its old parser.
+        """
+        with self._refresh_lock:
+            report = ReloadReport()
+            start_time = time.perf_counter()
+            old_entries = self._entries
+            name_to_path = self._scan_files()
+            new_entries:dict[str, _TemplateEntry] = {}
+            to_load:dict[str, str] = {}
+            for name, path in name_to_path.items():
+                if name in old_entries and not self._is_changed(old_entries[name].file_mtimes):
+                    new_entries[name] = old_entries[name]
+                else:
+                    to_load[name] = path
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                futures = {name: executor.submit(self._load, path, old_entries.get(name)) for name, path in to_load.items()}
+            for name, future in futures.items():
+                try:
+                    new_entries[name], is_reparsed = future.result()
+                    if is_reparsed:
+                        report.reloaded_names.append(name)
+                except (PMLBaseException, OSError, ValueError, AssertionError) as e:
+                    report.failed_names[name] = e
+                    if name in old_entries:
+                        new_entries[name] = old_entries[name]
+            report.removed_names = sorted(set(old_entries.keys()) - set(name_to_path.keys()))
+            self._entries = new_entries
+            report.reloaded_names.sort()
+            report.seconds = time.perf_counter() - start_time
+            report.memory_bytes = _estimate_trees_size([entry.parser.template_tree for entry in new_entries.values()])
+            self.last_report = report
+            return report
+
+    def start_watching(self, interval_seconds:float=1.0):
+        """
+        Poll the directory in a daemon thread, and call `refresh()` every `interval_seconds`.
+        """
+        if self._watch_thread is not None:
+            return
+        self._stop_watching_event.clear()
+        def _watch():
+            while not self._stop_watching_event.wait(interval_seconds):
+                self.refresh()
+        self._watch_thread = threading.Thread(target=_watch, name="TemplateRegistryWatcher", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        if self._watch_thread is None:
+            return
+        self._stop_watching_event.set()
+        self._watch_thread.join()
+        self._watch_thread = None
+
+def _estimate_trees_size(trees:list[BaseNode]):
+    """
+    Roughly count bytes of nodes and their attributes. Fragments shared by several templates are counted once.
+    """
+    seen_ids:set[int] = set()
+    total = 0
+    stack:list = list(trees)
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen_ids:
+            continue
+        seen_ids.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, BaseNode):
+            total += sys.getsizeof(obj.__dict__)
+            stack.extend(value for key, value in obj.__dict__.items() if key != "father")
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+    return total
@@ -0,0 +1,76 @@
+import pytest
+
+from ProMaid import PmlParser
+from ProMaid.Errors import IfKeywordUnpairedError, ImproperTypeDataInExpressionError
+
+
+def _build(template:str, **data):
+    # Same output with and without parse-time optimization
+    prompt = PmlParser(template).build_prompt(**data)
+    assert PmlParser(template, is_optimize=False).build_prompt(**data) == prompt
+    return prompt
+
+@pytest.mark.parametrize("flag, expected", [(True, "Y"), (False, "N"), (None, "N"), (1, "Y"), ("", "N")])
+def test_condition_of_data(flag, expected):
+    assert _build("{if:data(flag)}Y{else}N{end}", flag=flag) == expected
+
+def test_condition_compares_strings():
+    template = "{if:data(name) == 'bob'}Hi bob{else}Who?{end}"
+    assert _build(template, name="bob") == "Hi bob"
+    assert _build(template, name="it's \"me\"") == "Who?"
+
+def test_data_in_condition_is_type_checked():
+    with pytest.raises(ImproperTypeDataInExpressionError):
+        PmlParser("{if:data(flag)}Y{end}").build_prompt(flag=[1])
+    # Outside conditions, only numbers and strings
+    with pytest.raises(ImproperTypeDataInExpressionError):
+        PmlParser("{print:data(flag)}{print:data(flag) and 1}").build_prompt(flag=True)
+
+@pytest.mark.parametrize("template, line_number", [
+    ("{else}", 1),
+    ("a\n{loop:x}\n{else}\n{end}", 3),
+    ("{if:1}\na\n{else}\nb\n{else}\nc\n{end}", 5),
+    ("{if:1}\n{loop:x}\n{else}\n{end}\n{end}", 3),
+    ("text\n{if:1}\nabc", 2),
+    ("{if:1}\n{loop:x}\n{end}", 1),
+])
+def test_unpaired_if_and_else(template, line_number):
+    with pytest.raises(IfKeywordUnpairedError) as exception_info:
+        PmlParser(template)
+    assert exception_info.value.line_number == line_number
+
+def test_if_nested_with_loops():
+    template = """{loop:groups}
+{if:len(~.items) == 0}
+{data:~.name}: empty
+{else}
+{data:~.name}:
+{loop:~.items}
+{if:data(~.score) >= 5}
+  {print:index} pass
+{else}
+  {print:index} fail
+{end}
+{end}
+{end}
+{end}"""
+    groups = [{"name": "A", "items": [{"score": 7}, {"score": 2}]}, {"name": "B", "items": []}]
+    assert _build(template, groups=groups) == "A:\n  0 pass\n  1 fail\nB: empty\n"
+
+def test_untaken_branch_is_not_evaluated():
+    template = "{if:data(flag)}\n{print:undefined_variable}{data:missing.path}\n{else}\nok\n{end}"
+    assert _build(template, flag=False) == "ok\n"
+    template = "{if:data(flag)}\nok\n{else}\n{loop:missing}\n{end}\n{end}"
+    assert _build(template, flag=True) == "ok\n"
+
+def test_constant_condition_is_folded():
+    template = "{var:n = 3}\n{if:n > 2}\nbig {print:n * 2}\n{else}\nsmall {data:missing}\n{end}"
+    parser = PmlParser(template)
+    assert parser.build_prompt() == "big 6\n"
+    assert parser.optimization_stats["folded"] >= 2
+    # The folded if is gone from the tree, only the taken branch is left
+    assert "IfNode" not in repr(parser.template_tree)
+    # Not folded: the variable is assigned in a loop
+    template = "{var:n = 0}\n{loop:items}\n{var:n = 5}\n{end}\n{if:n > 2}\nbig\n{else}\nsmall\n{end}"
+    assert _build(template, items=[{}]) == "big\n"
+    assert _build(template, items=[]) == "small\n"
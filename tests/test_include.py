@@ -0,0 +1,39 @@
+import pytest
+
+from ProMaid import PmlParser
+from ProMaid.Errors import IncludeCycleError, IncludeFileNotFoundError, PathNotFoundError
+
+
+def _write_files(directory, files:dict[str, str]):
+    for name, text in files.items():
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding='utf-8')
+
+def test_include_shares_context(tmp_path):
+    _write_files(tmp_path, {"main.pml": "Top\n{loop:items}\n{include:parts/item.pml}\n{end}\nEnd",
+                            "parts/item.pml": "* {print:index}:{data:~.name}\n"})
+    parser = PmlParser(template_path=str(tmp_path / "main.pml"))
+    assert parser.build_prompt(items=[{"name": "a"}, {"name": "b"}]) == "Top\n* 0:a\n* 1:b\nEnd"
+
+def test_include_cycle(tmp_path):
+    _write_files(tmp_path, {"main.pml": "{include:a.pml}\n", "a.pml": "A\n{include:b.pml}\n", "b.pml": "B\n{include:a.pml}\n"})
+    with pytest.raises(IncludeCycleError) as error_info:
+        PmlParser(template_path=str(tmp_path / "main.pml"))
+    assert "a.pml -> " in str(error_info.value) and str(error_info.value).endswith('a.pml"')
+
+def test_missing_fragment(tmp_path):
+    _write_files(tmp_path, {"main.pml": "Line 1\n{include:missing.pml}\n"})
+    with pytest.raises(IncludeFileNotFoundError) as error_info:
+        PmlParser(template_path=str(tmp_path / "main.pml"))
+    assert error_info.value.line_number == 2
+    assert "missing.pml" in str(error_info.value)
+
+def test_error_in_fragment_reports_fragment_line_and_file(tmp_path):
+    _write_files(tmp_path, {"main.pml": "Line 1\nLine 2\n{include:part.pml}\n", "part.pml": "Part line 1\n{data:nope}\n"})
+    parser = PmlParser(template_path=str(tmp_path / "main.pml"))
+    with pytest.raises(PathNotFoundError) as error_info:
+        parser.build_prompt()
+    assert error_info.value.line_number == 2
+    assert error_info.value.file_path == str((tmp_path / "part.pml").resolve())
+    assert f'Line 2 of "{error_info.value.file_path}"' in str(error_info.value)
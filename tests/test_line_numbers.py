@@ -0,0 +1,46 @@
+import pytest
+
+from ProMaid import PmlParser
+from ProMaid.Errors import ImproperTypeDataInExpressionError, ListOutOfIndexError, LoopKeywordUnpairedError, PathNotFoundError, VariableReferenceError
+from ProMaid.source_map import SourceMap
+
+
+def _error_line(template:str, error_type:type, is_clean_whitespace:bool=False, **data):
+    with pytest.raises(error_type) as exception_info:
+        PmlParser(template, is_clean_whitespace_at_the_end_of_lines=is_clean_whitespace).build_prompt(**data)
+    return exception_info.value.line_number
+
+@pytest.mark.parametrize("is_clean_whitespace", [False, True])
+def test_line_after_blank_lines(is_clean_whitespace):
+    assert _error_line("a\n\n{print:data(x)}", PathNotFoundError, is_clean_whitespace) == 3
+    assert _error_line("\n\n\nfoo {data:missing}\n", PathNotFoundError, is_clean_whitespace) == 4
+
+@pytest.mark.parametrize("is_clean_whitespace", [False, True])
+def test_line_after_comments(is_clean_whitespace):
+    template = "# comment line\ntext # trailing comment   \n  # indented comment\n\n{print:data(q)}"
+    assert _error_line(template, PathNotFoundError, is_clean_whitespace) == 5
+
+@pytest.mark.parametrize("is_clean_whitespace", [False, True])
+def test_line_after_invisible_tags(is_clean_whitespace):
+    template = "{var:a = 1}\n{loop:items}\n{var:a += 1}\n{end}\n{if:a > 0}\n{else}\n{end}\n{print:b + 1}"
+    assert _error_line(template, VariableReferenceError, is_clean_whitespace, items=[{}]) == 8
+
+def test_line_in_nested_loops():
+    template = "{loop:L}\n{loop:~.m}\n\n  {print:nope + 1}\n{end}\n{end}\n"
+    assert _error_line(template, VariableReferenceError, L=[{"m": [1]}]) == 4
+
+def test_line_of_data_in_expression_and_path():
+    assert _error_line("line1\n\n{var:q = data(M.[5])}\n", ListOutOfIndexError, M=[1]) == 3
+    assert _error_line("# c\n{print:data(x) + 1}", ImproperTypeDataInExpressionError, x=[1]) == 2
+
+def test_line_of_unpaired_loop():
+    with pytest.raises(LoopKeywordUnpairedError) as exception_info:
+        PmlParser("x\n# c\n{loop:L}\nbody\n")
+    assert exception_info.value.line_number == 3
+
+def test_source_map_position():
+    source_map = SourceMap("ab\ncd\n\nefg")
+    assert source_map.position_of(0) == (1, 1)
+    assert source_map.position_of(4) == (2, 2)
+    assert source_map.position_of(6) == (3, 1)
+    assert source_map.position_of(9) == (4, 3)
@@ -0,0 +1,35 @@
+from ProMaid import METRICS, PmlParser, RenderSession
+
+
+def _render_count(name:str):
+    for value in METRICS.as_dict()["histograms"].get("render_seconds", []):
+        if value["labels"] == {"template": name}:
+            return value["count"]
+    return 0
+
+def _output_bytes_sum(name:str):
+    for value in METRICS.as_dict()["histograms"].get("output_bytes", []):
+        if value["labels"] == {"template": name}:
+            return value["sum"]
+    return 0
+
+def test_each_public_render_is_counted_once():
+    METRICS.enable()
+    METRICS.reset()
+    try:
+        parser = PmlParser("Head {data:a}\n{loop:turns}\n- {data:~.text}\n{end}\nTail", name="metrics_test")
+        turns = [{"text": "x"}]
+        prompt = parser.build_prompt(a=1, turns=turns)
+        assert _render_count("metrics_test") == 1
+        static_prefix, _, dynamic_suffix = parser.build_prompt_with_static_prefix(a=1, turns=turns)
+        assert _render_count("metrics_test") == 2
+        session = RenderSession(parser)
+        session.render(a=1, turns=turns)
+        turns.append({"text": "y"})
+        full_prompt, _ = session.render(a=1, turns=turns)
+        assert _render_count("metrics_test") == 4
+        assert _output_bytes_sum("metrics_test") == len(prompt) * 3 + len(full_prompt)
+        assert static_prefix + dynamic_suffix == prompt
+    finally:
+        METRICS.disable()
+        METRICS.reset()
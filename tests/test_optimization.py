@@ -0,0 +1,43 @@
+import pytest
+
+from ProMaid import PmlParser
+from ProMaid.Errors import ExpressionEvaluationUnknownExceptionError
+
+
+TEMPLATE = """# Header comment
+{var:width = 4}
+{var:total = 0}
+Width {print:width * 2}, {calc:width + 1} # trailing comment
+{loop:items}
+{var:total += data(~.n)}
+- {print:index}: {data:~.name} {print:width} {calc:total}
+{end}
+{if:width > 3}
+Wide {print:width ** 2}
+{else}
+Narrow
+{end}
+Total {print:total}, {print:len(items) + width}
+"""
+
+DATA = {"items": [{"name": "a", "n": 1}, {"name": "b", "n": 2}]}
+
+def test_optimized_output_is_same():
+    optimized = PmlParser(TEMPLATE)
+    unoptimized = PmlParser(TEMPLATE, is_optimize=False)
+    assert optimized.build_prompt(**DATA) == unoptimized.build_prompt(**DATA)
+    assert unoptimized.optimization_stats == {"folded": 0, "eliminated": 0}
+    assert optimized.optimization_stats["folded"] >= 4
+    assert optimized.optimization_stats["eliminated"] > 0
+
+def test_variable_assigned_twice_is_not_folded():
+    template = "{var:x = 1}\n{print:x}\n{var:x = 2}\n{print:x}"
+    assert PmlParser(template).build_prompt() == PmlParser(template, is_optimize=False).build_prompt() == "1\n2"
+    assert PmlParser(template).optimization_stats["folded"] == 0
+
+def test_unprintable_constant_is_not_folded():
+    template = "A {print:pow(10, 5000)}"
+    parser = PmlParser(template)
+    assert parser.optimization_stats["folded"] == 0
+    with pytest.raises(ExpressionEvaluationUnknownExceptionError):
+        parser.build_prompt()
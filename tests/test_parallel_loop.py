@@ -0,0 +1,20 @@
+from ProMaid import PmlParser, pml_parser
+
+
+TEMPLATE = "{loop:items}\n{print:index}:{data:~.name};\n{end}\nEND"
+
+def test_parallel_fill_is_same_as_sequential(monkeypatch):
+    items = [{"name": f"n{i}"} for i in range(100)]
+    expected = PmlParser(TEMPLATE).build_prompt(items=items)
+    monkeypatch.setattr(pml_parser, "_is_gil_enabled", lambda: False)
+    parser = PmlParser(TEMPLATE, max_loop_workers=3, min_parallel_loop_iterations=8)
+    assert parser.build_prompt(items=items) == expected
+
+def _fail_to_get_loop_executor():
+    raise AssertionError("Loop iterations should not be filled by the thread pool")
+
+def test_no_parallel_fill_with_gil(monkeypatch):
+    monkeypatch.setattr(pml_parser, "_is_gil_enabled", lambda: True)
+    monkeypatch.setattr(pml_parser, "_get_loop_executor", _fail_to_get_loop_executor)
+    parser = PmlParser(TEMPLATE, max_loop_workers=4, min_parallel_loop_iterations=1)
+    assert parser.build_prompt(items=[{"name": "a"}, {"name": "b"}]) == "0:a;\n1:b;\nEND"
@@ -0,0 +1,50 @@
+import io
+
+import pytest
+
+from ProMaid import PmlParser
+
+
+TEMPLATE = """Question: {data:question}
+{var:count = 0}
+{loop:choices}
+{var:count += 1}
+{print:index}. {data:~.text}
+{end}
+{if:len(choices) > 2}
+Many choices: {print:count}
+{end}
+Answer: {data:answer}"""
+
+COLUMNS = {
+    "question": ["1 + 1?", "Color of sky?", "Capital of France?"],
+    "choices": [[{"text": text} for text in choices] for choices in [["1", "2"], ["blue", "red", "green"], ["Paris", "Rome", "Berlin", "Madrid"]]],
+    "answer": [2, "blue", None],
+}
+
+def _rows(columns:dict, n_rows:int):
+    return [{name: column[row] for name, column in columns.items()} for row in range(n_rows)]
+
+def test_render_columns_is_same_as_build_prompt():
+    parser = PmlParser(TEMPLATE)
+    expected = [parser.build_prompt(**row) for row in _rows(COLUMNS, 3)]
+    assert parser.render_columns(COLUMNS, 3) == expected
+    # Fewer rows than the columns have
+    assert parser.render_columns(COLUMNS, 2) == expected[:2]
+
+def test_render_columns_to_output():
+    parser = PmlParser(TEMPLATE)
+    expected = [parser.build_prompt(**row) for row in _rows(COLUMNS, 3)]
+    output = io.StringIO()
+    assert parser.render_columns(COLUMNS, 3, output=output, separator="\n---\n") is None
+    assert output.getvalue() == "".join(prompt + "\n---\n" for prompt in expected)
+
+def test_render_columns_with_data_in_expression():
+    template = "{data:name} is {print:data(age) + 1} next year, {data:name} again"
+    columns = {"name": ["Ann", "Bob"], "age": [30, 41]}
+    parser = PmlParser(template)
+    assert parser.render_columns(columns, 2) == [parser.build_prompt(**row) for row in _rows(columns, 2)]
+
+def test_render_columns_short_column():
+    with pytest.raises(ValueError):
+        PmlParser(TEMPLATE).render_columns(COLUMNS, 4)
@@ -0,0 +1,63 @@
+from ProMaid import PmlParser, RenderSession
+
+
+def _render_growing(template:str, items:list):
+    session = RenderSession(PmlParser(template))
+    results = []
+    for count in range(1, len(items)+1):
+        turns = items[:count]
+        full_prompt, new_suffix = session.render(turns=turns)
+        assert full_prompt == PmlParser(template).build_prompt(turns=turns)
+        assert full_prompt.endswith(new_suffix)
+        results.append(session.is_last_render_incremental)
+    return results
+
+def test_appended_items_are_rendered_incrementally():
+    template = "Turns:\n{loop:turns}\n[{print:index}] {data:~.text}\n{end}\nEND {print:len(turns)}\n"
+    assert _render_growing(template, [{"text": "a"}, {"text": "b"}, {"text": "c"}]) == [False, True, True]
+
+def test_list_read_outside_item_disables_incremental_render():
+    template = "Turns: {print:len(turns)}\n{loop:turns}\n{data:~.text}{if:index == len(turns) - 1}\n <-last\n{end}\n\n{end}\nEND\n"
+    assert _render_growing(template, [{"text": "a"}, {"text": "b"}]) == [False, False]
+    session = RenderSession(PmlParser(template))
+    session.render(turns=[{"text": "a"}])
+    assert session.render(turns=[{"text": "a"}, {"text": "b"}])[0] == "Turns: 2\na\nb <-last\n\nEND\n"
+
+def test_list_read_by_absolute_path_in_body_disables_incremental_render():
+    template = "{loop:turns}\n{data:~.text} then {print:data(turns.[0].text)}\n{end}\n"
+    assert _render_growing(template, [{"text": "a"}, {"text": "b"}]) == [False, False]
+
+def test_items_changed_in_place_are_rendered_again():
+    template = "{data:title}\n{loop:turns}\n{data:~.t}\n{end}\n"
+    parser = PmlParser(template)
+    session = RenderSession(parser)
+    turns = [{"t": "a"}]
+    session.render(title="T", turns=turns)
+    turns[0]["t"] = "EDITED"
+    turns.append({"t": "b"})
+    assert session.render(title="T", turns=turns)[0] == parser.build_prompt(title="T", turns=turns) == "T\nEDITED\nb\n"
+    assert session.is_last_render_incremental is False
+    # Nested values of other data are compared by value too
+    template = "{data:meta.tags.[0]}\n{loop:turns}\n{data:~.t}\n{end}\n"
+    session = RenderSession(PmlParser(template))
+    meta = {"tags": ["x"]}
+    session.render(meta=meta, turns=[{"t": "a"}])
+    meta["tags"][0] = "y"
+    assert session.render(meta=meta, turns=[{"t": "a"}, {"t": "b"}])[0] == "y\na\nb\n"
+    assert session.is_last_render_incremental is False
+
+def test_variables_assigned_around_the_loop_keep_incremental_render():
+    template = "{var:k = 0}\n{loop:turns}\n{data:~.text} {print:k}\n{end}\n"
+    assert _render_growing(template, [{"text": str(i)} for i in range(5)]) == [False, True, True, True, True]
+    template = "{loop:turns}\n{data:~.text}\n{end}\n{var:n = len(turns)}\nN={print:n}\n"
+    assert _render_growing(template, [{"text": str(i)} for i in range(5)]) == [False, True, True, True, True]
+
+def test_changed_variable_read_by_kept_output_disables_incremental_render():
+    template = "{var:k += 1}\nRender {print:k}\n{loop:turns}\n{data:~.text}\n{end}\n"
+    parser = PmlParser(template)
+    parser._global_variable_dict["k"] = 0
+    session = RenderSession(parser)
+    assert session.render(turns=[{"text": "a"}])[0] == "Render 1\na\n"
+    # k read before assigned at render start, changed by the previous render
+    assert session.render(turns=[{"text": "a"}, {"text": "b"}])[0] == "Render 2\na\nb\n"
+    assert session.is_last_render_incremental is False
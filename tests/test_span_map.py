@@ -0,0 +1,41 @@
+from ProMaid import PmlParser
+
+
+def test_spans_with_repeated_values_and_if():
+    template = "Hi {data:name}!\n{loop:items}\n{if:data(~.n) > 1}\n- {data:~.label} {print:data(~.label)}\n{end}\n{end}\nBye {data:name}"
+    data = {"name": "ab", "items": [{"n": 2, "label": "x"}, {"n": 0, "label": "y"}, {"n": 5, "label": "x"}]}
+    prompt, spans = PmlParser(template).build_prompt_with_spans(**data)
+    assert prompt == PmlParser(template).build_prompt(**data) == "Hi ab!\n- x x\n- x x\nBye ab"
+    # Same values at different places get their own spans, items skipped by the if have none
+    assert list(spans) == [(3, 5, 1, "name", ()),
+                           (9, 10, 4, "~.label", (0,)), (11, 12, 4, "~.label", (0,)),
+                           (15, 16, 4, "~.label", (2,)), (17, 18, 4, "~.label", (2,)),
+                           (23, 25, 7, "name", ())]
+    assert spans.paths == ["name", "~.label"]
+    assert spans[-1] == (23, 25, 7, "name", ())
+
+def test_spans_in_nested_loops():
+    template = "{loop:groups}\n[{data:~.name}]\n{loop:~.members}\n{print:index}={data:~.id};\n{end}\n{end}"
+    data = {"groups": [{"name": "g0", "members": [{"id": 7}, {"id": 7}]}, {"name": "g1", "members": [{"id": 8}]}]}
+    prompt, spans = PmlParser(template).build_prompt_with_spans(**data)
+    assert prompt == "[g0]\n0=7;\n1=7;\n[g1]\n0=8;\n"
+    assert [(prompt[start:end], path, loop_indices) for start, end, _, path, loop_indices in spans] == [
+        ("g0", "~.name", (0,)), ("7", "~.id", (0, 0)), ("7", "~.id", (0, 1)),
+        ("g1", "~.name", (1,)), ("8", "~.id", (1, 0))]
+    assert [template_line for _, _, template_line, _, _ in spans] == [2, 4, 4, 2, 4]
+
+def test_spans_in_include(tmp_path):
+    (tmp_path / "item.pml").write_text("# fragment\n* {data:~.name}\n", encoding='utf-8')
+    (tmp_path / "main.pml").write_text("{data:title}\n{loop:items}\n{include:item.pml}\n{end}\n{data:title}", encoding='utf-8')
+    data = {"title": "T", "items": [{"name": "a"}, {"name": "bb"}]}
+    prompt, spans = PmlParser(template_path=str(tmp_path / "main.pml")).build_prompt_with_spans(**data)
+    assert prompt == "T\n* a\n* bb\nT"
+    # Lines of tags in the fragment are counted in the fragment file
+    assert list(spans) == [(0, 1, 1, "title", ()), (4, 5, 2, "~.name", (0,)), (8, 10, 2, "~.name", (1,)), (11, 12, 5, "title", ())]
+
+def test_spans_of_top_level_data():
+    template = "{data:a} and {print:data(b)}, {data:a}\n{print:data(b) + 1}"
+    data = {"a": "left", "b": 10}
+    prompt, spans = PmlParser(template).build_prompt_with_spans(**data)
+    # Only pure data(path) prints are spans
+    assert [(prompt[start:end], path) for start, end, _, path, _ in spans] == [("left", "a"), ("10", "b"), ("left", "a")]
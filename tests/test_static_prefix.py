@@ -0,0 +1,45 @@
+from typing import Optional
+
+from ProMaid import PmlParser
+from ProMaid.Errors import PathNotFoundError
+
+
+def _check_split(parser:PmlParser, static_data:Optional[dict]=None, **data):
+    static_prefix, prefix_hash, dynamic_suffix = parser.build_prompt_with_static_prefix(**data)
+    assert static_prefix + dynamic_suffix == parser.build_prompt(**(static_data or {}), **data)
+    return static_prefix, dynamic_suffix
+
+def test_prefix_ends_inside_include(tmp_path):
+    (tmp_path / "instr.pml").write_text("Long instructions.\n{var:k=2}\nRule {print:k}.\nUser: {data:q}\nBye\n", encoding='utf-8')
+    (tmp_path / "main.pml").write_text("{include:instr.pml}\nEnd {print:k}\n", encoding='utf-8')
+    parser = PmlParser(template_path=str(tmp_path / "main.pml"))
+    for q in ["a", "b"]:
+        static_prefix, dynamic_suffix = _check_split(parser, q=q)
+        assert static_prefix == "Long instructions.\nRule 2.\nUser: "
+        assert dynamic_suffix == f"{q}\nBye\nEnd 2\n"
+
+def test_error_in_suffix_of_include_reports_fragment(tmp_path):
+    (tmp_path / "instr.pml").write_text("Static\n{data:q.missing}\n", encoding='utf-8')
+    (tmp_path / "main.pml").write_text("{include:instr.pml}\n", encoding='utf-8')
+    parser = PmlParser(template_path=str(tmp_path / "main.pml"))
+    try:
+        parser.build_prompt_with_static_prefix(q={})
+        assert False, "Should raise PathNotFoundError"
+    except PathNotFoundError as e:
+        assert e.line_number == 2
+        assert e.file_path is not None and e.file_path.endswith("instr.pml")
+
+def test_prefix_ends_inside_if_with_static_condition():
+    parser = PmlParser("Intro\n{if:len(shots) > 1}\nShots: {print:len(shots)}\nAsk {data:q}\n{else}\nNo shots {data:q}\n{end}\nTail {data:q}\n")
+    parser.bind_static_data(shots=[1, 2])
+    static_prefix, dynamic_suffix = _check_split(parser, {"shots": [1, 2]}, q="x")
+    assert static_prefix == "Intro\nShots: 2\nAsk "
+    assert dynamic_suffix == "x\nTail x\n"
+    parser.bind_static_data(shots=[])
+    static_prefix, dynamic_suffix = _check_split(parser, {"shots": []}, q="y")
+    assert static_prefix == "Intro\nNo shots "
+
+def test_prefix_stops_at_if_with_dynamic_condition():
+    parser = PmlParser("Intro\n{if:len(q) > 1}\nLong\n{end}\n")
+    static_prefix, _ = _check_split(parser, q="abc")
+    assert static_prefix == "Intro\n"
@@ -0,0 +1,27 @@
+from ProMaid import PmlParser, TemplateGroup
+
+
+def test_lookups_are_shared_across_variants():
+    templates = {f"v{i}": f"Variant {i}: {{data:q.text}} {{print:len(items)}} {{print:data(q.deep.x) + {i}}}" for i in range(5)}
+    group = TemplateGroup({name: PmlParser(template) for name, template in templates.items()})
+    data = {"q": {"text": "hello", "deep": {"x": 1}}, "items": [1, 2, 3]}
+    prompts = group.render(**data)
+    for name, template in templates.items():
+        assert prompts[name] == PmlParser(template).build_prompt(**data)
+    stats = [group._parsers[name].lookup_cache_stats for name in templates]
+    # Only the first variant resolves the paths (len(items) resolves "items" too), the others hit the shared cache
+    assert stats[0] == {"path_hits": 0, "path_misses": 3, "len_hits": 0, "len_misses": 1}
+    for variant_stats in stats[1:]:
+        assert variant_stats == {"path_hits": 2, "path_misses": 0, "len_hits": 1, "len_misses": 0}
+
+def test_identical_loops_are_rendered_once():
+    shots = "{loop:shots}\nQ{print:index}: {data:~.q}\n{end}\n"
+    templates = {"a": "A\n{var:k=1}\n" + shots + "Ask {data:query} {print:k}", 
+                 "b": "B {data:query}\n" + shots + "{var:k=2}\nDone {print:k}", 
+                 "c": "C\n{var:k=5}\n{loop:shots}\n- {data:~.q} {print:k}\n{end}\n"}
+    group = TemplateGroup({name: PmlParser(template) for name, template in templates.items()})
+    data = {"shots": [{"q": "x"}, {"q": "y"}], "query": "what"}
+    prompts = group.render(**data)
+    for name, template in templates.items():
+        assert prompts[name] == PmlParser(template).build_prompt(**data)
+    assert group.shared_loop_stats == {"hits": 1, "misses": 1}
@@ -0,0 +1,33 @@
+import os
+
+from ProMaid import PmlParser, TemplateRegistry
+
+
+def _write(path, text:str):
+    path.write_text(text, encoding='utf-8')
+    # Make sure mtime changes on file systems with coarse timestamps
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+def test_nested_fragment_edit_is_reloaded(tmp_path):
+    _write(tmp_path / "main.pml", "{include:a.pml}\n")
+    _write(tmp_path / "a.pml", "A\n{include:b.pml}\n")
+    _write(tmp_path / "b.pml", "B-old\n")
+    registry = TemplateRegistry(str(tmp_path))
+    assert registry["main"].build_prompt() == "A\nB-old\n"
+    _write(tmp_path / "b.pml", "B-new\n")
+    report = registry.refresh()
+    assert "main" in report.reloaded_names
+    assert registry["main"].build_prompt() == "A\nB-new\n"
+    assert registry["a"].build_prompt() == "A\nB-new\n"
+    assert PmlParser(template_path=str(tmp_path / "main.pml")).build_prompt() == "A\nB-new\n"
+
+def test_touched_template_is_not_reparsed(tmp_path):
+    _write(tmp_path / "main.pml", "{include:a.pml}\n")
+    _write(tmp_path / "a.pml", "A\n")
+    registry = TemplateRegistry(str(tmp_path))
+    parser = registry["main"]
+    _write(tmp_path / "main.pml", "{include:a.pml}\n")
+    report = registry.refresh()
+    assert report.reloaded_names == []
+    assert registry["main"] is parser
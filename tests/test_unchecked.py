@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from ProMaid import PmlParser
+from ProMaid.Errors import ImproperTypeDataInExpressionError, RecordNotValidatedError
+
+
+TEMPLATE = """{loop:items}
+{print:index}. {data:~.name} x{print:data(~.count) * 2}
+{end}
+Total: {print:len(items)}"""
+
+RECORDS = [
+    {"items": [{"name": "a", "count": 1}, {"name": "b", "count": 2}]},
+    {"items": [{"name": "c", "count": 3}]},
+]
+
+def test_unchecked_is_same_as_build_prompt():
+    parser = PmlParser(TEMPLATE)
+    parser.validate(RECORDS)
+    for record in RECORDS:
+        assert parser.build_prompt_unchecked(**record) == parser.build_prompt(**record)
+
+def test_unchecked_requires_validate():
+    parser = PmlParser(TEMPLATE)
+    with pytest.raises(RecordNotValidatedError):
+        parser.build_prompt_unchecked(**RECORDS[0])
+
+def test_unchecked_rejects_other_keys():
+    parser = PmlParser(TEMPLATE)
+    parser.validate(RECORDS)
+    with pytest.raises(RecordNotValidatedError):
+        parser.build_prompt_unchecked(items=[], extra=1)
+    with pytest.raises(RecordNotValidatedError):
+        parser.validate([{"items": []}, {"items": [], "extra": 1}])
+    # A failed validate() forgets the previous one
+    with pytest.raises(RecordNotValidatedError):
+        parser.build_prompt_unchecked(**RECORDS[0])
+
+def test_checked_render_stays_checked_while_unchecked_renders():
+    parser = PmlParser(TEMPLATE)
+    parser.validate(RECORDS)
+    bad_record = {"items": [{"name": "a", "count": [1]}]}
+    stop = threading.Event()
+
+    def render_unchecked():
+        while not stop.is_set():
+            parser.build_prompt_unchecked(**RECORDS[0])
+
+    thread = threading.Thread(target=render_unchecked)
+    thread.start()
+    try:
+        for _ in range(200):
+            with pytest.raises(ImproperTypeDataInExpressionError):
+                parser.build_prompt(**bad_record)
+    finally:
+        stop.set()
+        thread.join()